@@ -1,39 +1,92 @@
+import argparse
+import asyncio
+import os
 import re
+import sys
+import time
+from datetime import date, timedelta
+from urllib.parse import urlsplit
 import requests
-import csv
 import json
 from xml.etree import ElementTree as ET
 
+import breaker
+import cache
+import catalog
+import concurrency
+import hedge
+import journal
+import packing
+import ratelimit
+import retry
+import router
+import transport
+import writers
+
 # PubMed Search API Parameters
 pubmed_search_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 pubmed_fetch_url = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
 
+# Optional NCBI API key; it raises the E-utilities limit from 3 to 10 requests/s
+ncbi_api_key = os.environ.get("NCBI_API_KEY")
+ratelimit.configure_ncbi_limiter(ncbi_api_key)
+
+# Largest page E-utilities will return for one ESearch call, and the page size
+# used when listing search results
+esearch_max_retmax = 10000
+search_page_size = esearch_max_retmax
+
+# ESearch cannot page past this many results of a single query, so larger
+# searches are split into date windows below it. Windows are on the Entrez
+# date (the day a record was added to PubMed), which every record has exactly
+# once; the publication date ("pdat") matches both the print and the
+# electronic date, so a record could fall into two windows. The newest
+# window is left open-ended.
+esearch_max_results = 10000
+search_datetype = "edat"
+earliest_pubmed_date = date(1800, 1, 1)
+latest_pubmed_date = date(3000, 1, 1)
+
+# Number of PMIDs requested per EFetch call when fetching abstracts in bulk
+efetch_batch_size = 200
+
+# Keep fetched abstracts on disk so reruns do not download them again
+use_abstract_cache = True
+_abstract_cache = None
+
+# Reuse earlier completions for identical model + prompt + abstract requests
+use_llm_cache = True
+_llm_cache = None
+
 # OpenRouter LLM API
 llm_api_url = "https://openrouter.ai/api/v1/chat/completions"
 llm_api_key = (
     "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"
 )
 
-# Example search keyword
-keyword = input("Enter the clinical trial keyword (e.g., Breast Cancer): ")
 
-# Pagination control
-total_pages = int(input("Enter the number of pages to scrape: "))
+# Check available models and allow model selection. The local
+# available_models.json is used right away and revalidated in the background
+# once it is older than catalog.catalog_ttl.
+def check_available_models():
+    models = catalog.load_catalog(on_update=remember_models)
+    if models:
+        remember_models(models)
+    return models
 
 
-# Check available models and allow model selection
-def check_available_models():
-    models_url = "https://openrouter.ai/api/v1/models"
-    response = requests.get(models_url)
-    if response.status_code == 200:
-        models = response.json()
-        with open("available_models.json", "w") as json_file:
-            json.dump(models, json_file, indent=4)
-        print("Models have been exported to 'available_models.json'")
-        return models
-    else:
-        print(f"Failed to fetch available models: {response.status_code}, {response.text}")
-        return None
+# Keep the catalog entries (context length, pricing, ...) by model id, and
+# note which models accept a JSON schema response_format
+def remember_models(models):
+    for model in models.get("data", []):
+        model_info[model["id"]] = model
+        if "structured_outputs" in model.get("supported_parameters", []):
+            structured_output_models.add(model["id"])
+
+
+# Token limits of a model, from its catalog entry
+def token_budget(selected_model):
+    return packing.TokenBudget(model_info.get(selected_model))
 
 
 # Choose a model from available options
@@ -45,16 +98,106 @@ def choose_model(models):
     return model_list[choice - 1]["id"] if 0 < choice <= len(model_list) else None
 
 
+# The on-disk abstract cache, opened on first use (None when disabled)
+def abstract_cache():
+    global _abstract_cache
+    if use_abstract_cache and _abstract_cache is None:
+        _abstract_cache = cache.AbstractCache()
+    return _abstract_cache if use_abstract_cache else None
+
+
+# The on-disk LLM completion cache, opened on first use (None when disabled)
+def llm_cache():
+    global _llm_cache
+    if use_llm_cache and _llm_cache is None:
+        _llm_cache = cache.LLMCache()
+    return _llm_cache if use_llm_cache else None
+
+
+# Send an E-utilities GET request, paced by the shared NCBI rate limiter and
+# retried with backoff on transient errors (see retry.ncbi_policy). Returns the
+# last response; raises if the connection kept failing.
+def eutils_get(url, params, attempts=None):
+    if ncbi_api_key:
+        params = {**params, "api_key": ncbi_api_key}
+
+    def send():
+        ratelimit.ncbi_limiter.acquire()
+        return transport.get(url, params=params)
+
+    return retry.ncbi_policy.call(send, "NCBI request", attempts)
+
+
+# PubMed query used for a keyword
+def search_term(keyword):
+    return f'{keyword} AND "Randomized Controlled Trial"[pt]'
+
+
+# ESearch parameters for a keyword, optionally limited to a date window
+def search_params(keyword, mindate=None, maxdate=None):
+    params = {"db": "pubmed", "term": search_term(keyword)}
+    if mindate or maxdate:
+        params["datetype"] = search_datetype
+        params["mindate"] = (mindate or earliest_pubmed_date).strftime("%Y/%m/%d")
+        params["maxdate"] = (maxdate or latest_pubmed_date).strftime("%Y/%m/%d")
+    return params
+
+
+# Count the PubMed results for a keyword without listing them
+def count_pubmed_results(keyword, mindate=None, maxdate=None):
+    params = {**search_params(keyword, mindate, maxdate), "rettype": "count"}
+    response = eutils_get(pubmed_search_url, params)
+    response.raise_for_status()  # Raise an error for HTTP errors
+    return int(ET.fromstring(response.text).findtext("Count") or 0)
+
+
+# Split a search into Entrez date windows that each hold no more than
+# esearch_max_results results. Returns [(mindate, maxdate, count)], newest first.
+# With a limit, only the newest windows holding that many results are
+# looked for: a window whose first esearch_max_results cover the limit is
+# not split, and older windows are not counted once newer ones cover it.
+# count is the window's result count, if already known.
+def partition_search(keyword, mindate=None, maxdate=None, count=None, limit=None):
+    mindate = mindate or earliest_pubmed_date
+    maxdate = maxdate or latest_pubmed_date
+    if count is None:
+        count = count_pubmed_results(keyword, mindate, maxdate)
+    if count == 0 or (limit is not None and limit <= 0):
+        return []
+    if count <= esearch_max_results or (limit is not None and limit <= esearch_max_results):
+        return [(mindate, maxdate, count)]
+    if mindate >= maxdate:
+        # A single day cannot be split any further
+        print(f"Only the first {esearch_max_results} of {count} results from {mindate} can be fetched")
+        return [(mindate, maxdate, count)]
+
+    # Split the dated part of the window; nothing is dated after today
+    split_end = min(maxdate, max(mindate, date.today()))
+    middle = mindate + timedelta(days=(split_end - mindate).days // 2)
+    newer = partition_search(keyword, middle + timedelta(days=1), maxdate, limit=limit)
+    if limit is not None:
+        limit -= sum(min(window_count, esearch_max_results) for _, _, window_count in newer)
+        if limit <= 0:
+            return newer
+    return newer + partition_search(keyword, mindate, middle, limit=limit)
+
+
+# Split the first `total` results into (retstart, retmax) pages
+def plan_pages(total, page_size):
+    page_size = max(1, min(page_size, esearch_max_retmax))
+    return [(retstart, min(page_size, total - retstart)) for retstart in range(0, total, page_size)]
+
+
 # Fetch PubMed results
-def fetch_pubmed_results(keyword, page_num):
+def fetch_pubmed_results(keyword, page_num, page_size=search_page_size, mindate=None, maxdate=None):
+    page_size = min(page_size, esearch_max_retmax)
     params = {
-        "db": "pubmed",
-        "term": f'{keyword} AND "Randomized Controlled Trial"[pt]',
-        "retstart": page_num * 10,
-        "retmax": 10,
+        **search_params(keyword, mindate, maxdate),
+        "retstart": page_num * page_size,
+        "retmax": page_size,
         "usehistory": "y",
     }
-    response = requests.get(pubmed_search_url, params=params)
+    response = eutils_get(pubmed_search_url, params)
     response.raise_for_status()  # Raise an error for HTTP errors
     return response.text
 
@@ -66,36 +209,355 @@ def parse_trial_ids(xml_response):
 
 # Fetch specific trial information (with retries for resilience)
 def fetch_trial_info(trial_id, retries=3):
+    store = abstract_cache()
+    if store:
+        cached = store.get_abstracts([trial_id])
+        if cached:
+            return cached[trial_id]
+
     params = {"db": "pubmed", "id": trial_id, "rettype": "abstract", "retmode": "text"}
-    for attempt in range(retries):
-        response = requests.get(pubmed_fetch_url, params=params)
+    try:
+        response = eutils_get(pubmed_fetch_url, params, retries)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch trial {trial_id}: {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Failed to fetch trial {trial_id} after {retries} attempts")
+        return None
+    if store:
+        store.put_abstracts({trial_id: response.text})
+    return response.text
+
+
+# Fetch the abstracts of many trials, efetch_batch_size PMIDs per request.
+# Returns {trial_id: text or None}; a failing batch is split in half and retried.
+def fetch_trial_infos(trial_ids, retries=3):
+    trial_ids = list(trial_ids)
+    store = abstract_cache()
+    results = store.get_abstracts(trial_ids) if store else {}
+    missing = [trial_id for trial_id in trial_ids if trial_id not in results]
+    for start in range(0, len(missing), efetch_batch_size):
+        batch = missing[start : start + efetch_batch_size]
+        fetched = fetch_trial_batch(batch, retries)
+        if store:
+            store.put_abstracts(fetched)
+        results.update(fetched)
+    return {trial_id: results.get(trial_id) for trial_id in trial_ids}
+
+
+# Fetch one batch of abstracts in a single EFetch request
+def fetch_trial_batch(trial_ids, retries=3):
+    if len(trial_ids) == 1:
+        return {trial_ids[0]: fetch_trial_info(trial_ids[0], retries)}
+
+    params = {"db": "pubmed", "id": ",".join(trial_ids), "rettype": "abstract", "retmode": "text"}
+    records = {}
+    try:
+        response = eutils_get(pubmed_fetch_url, params, retries)
         if response.status_code == 200:
-            return response.text
-        elif attempt < retries - 1:
-            print(f"Retry {attempt + 1}/{retries} for trial {trial_id}")
+            records = split_abstract_records(response.text)
         else:
-            print(f"Failed to fetch trial {trial_id} after {retries} attempts")
-            return None
+            print(f"Failed to fetch batch of {len(trial_ids)} trials after {retries} attempts")
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch batch of {len(trial_ids)} trials: {e}")
 
-# Fetch specific trial information (with retries for resilience)
-def call_llm_api(text_data, selected_model):
-    headers = {
-        "Authorization": f"Bearer {llm_api_key}",
-        "Content-Type": "application/json",
+    missing = [trial_id for trial_id in trial_ids if trial_id not in records]
+    if missing and len(missing) < len(trial_ids):
+        # Some records came back: fetch only the ones that did not
+        records.update(fetch_trial_batch(missing, retries))
+    elif missing:
+        # Nothing usable came back: bisect the batch
+        middle = len(trial_ids) // 2
+        records.update(fetch_trial_batch(trial_ids[:middle], retries))
+        records.update(fetch_trial_batch(trial_ids[middle:], retries))
+    return {trial_id: records.get(trial_id) for trial_id in trial_ids}
+
+
+# Split a multi-record text abstract response into {pmid: record}.
+# Records are numbered "1. ", "2. ", ...; each one is renumbered "1. " so it
+# reads exactly like the response of a single-PMID fetch.
+def split_abstract_records(text):
+    records = {}
+    for record in re.split(r"\n{3,}(?=\d+\.\s)", text.strip()):
+        match = re.search(r"^PMID:\s*(\d+)", record, re.MULTILINE)
+        if match:
+            records[match.group(1)] = re.sub(r"^\d+\.", "1.", record, count=1) + "\n"
+    return records
+
+
+# A PubMed search run once on the E-utilities history server. Its results are
+# then fetched in batches (abstracts included) through the WebEnv/query_key
+# instead of re-running the search and fetching every PMID separately.
+# mindate/maxdate restrict it to one Entrez date window (see partition_search).
+class SearchSession:
+    def __init__(self, keyword, batch_size=None, mindate=None, maxdate=None):
+        self.keyword = keyword
+        self.mindate = mindate
+        self.maxdate = maxdate
+        self.batch_size = batch_size or efetch_batch_size
+        self.count = 0
+        self.web_env = None
+        self.query_key = None
+        self.trial_ids = []
+
+    # Run the ESearch, keeping the history server handles and the result IDs
+    # (the IDs let cached abstracts be skipped when fetching batches)
+    def start(self):
+        params = {
+            **search_params(self.keyword, self.mindate, self.maxdate),
+            "retmax": search_page_size,
+            "usehistory": "y",
+        }
+        response = eutils_get(pubmed_search_url, params)
+        response.raise_for_status()  # Raise an error for HTTP errors
+        root = ET.fromstring(response.text)
+        self.count = int(root.findtext("Count") or 0)
+        self.web_env = root.findtext("WebEnv")
+        self.query_key = root.findtext("QueryKey")
+        self.trial_ids = parse_trial_ids(response.text)
+        return self
+
+    # (retstart, retmax) of every batch, covering at most `limit` results
+    def batch_ranges(self, limit=None):
+        total = min(self.count, esearch_max_results)
+        if limit is not None:
+            total = min(limit, total)
+        return plan_pages(total, self.batch_size)
+
+    # Fetch the abstracts of results retstart .. retstart + retmax, from the
+    # cache where possible. Returns [(trial_id, text)] in search order.
+    def fetch_batch(self, retstart, retmax, retries=3):
+        trial_ids = self.trial_ids[retstart : retstart + retmax]
+        store = abstract_cache()
+        cached = store.get_abstracts(trial_ids) if store and trial_ids else {}
+        if cached:
+            # Fetch only what is missing, by ID
+            trial_infos = fetch_trial_infos(trial_ids, retries)
+            return [(trial_id, trial_infos[trial_id]) for trial_id in trial_ids]
+
+        records = dict(self.fetch_history_batch(retstart, retmax, retries))
+        if records and store:
+            store.put_abstracts(records)
+        if records and not trial_ids and len(records) == retmax:
+            # Nothing to check the batch against, but nothing is missing either
+            return list(records.items())
+
+        if not trial_ids:
+            page = fetch_pubmed_results(
+                self.keyword, retstart // self.batch_size, self.batch_size, self.mindate, self.maxdate
+            )
+            trial_ids = parse_trial_ids(page)[:retmax]
+        missing = [trial_id for trial_id in trial_ids if trial_id not in records]
+        if missing:
+            # The history server left some records out (or gave nothing usable):
+            # fetch those by ID
+            print(f"Falling back to ID fetch for {len(missing)} of results {retstart + 1}-{retstart + retmax}")
+            records.update(fetch_trial_infos(missing, retries))
+        return [(trial_id, records.get(trial_id)) for trial_id in trial_ids]
+
+    # Fetch the abstracts of results retstart .. retstart + retmax from the
+    # history server. Returns [(trial_id, text)] in search order, or [] on failure.
+    def fetch_history_batch(self, retstart, retmax, retries=3):
+        params = {
+            "db": "pubmed",
+            "query_key": self.query_key,
+            "WebEnv": self.web_env,
+            "retstart": retstart,
+            "retmax": retmax,
+            "rettype": "abstract",
+            "retmode": "text",
+        }
+        try:
+            response = eutils_get(pubmed_fetch_url, params, retries)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed to fetch results {retstart + 1}-{retstart + retmax}: {e}")
+            return []
+        if response.status_code != 200:
+            return []
+        return list(split_abstract_records(response.text).items())
+
+
+# Answer ids ("11A", "Group1-2A", ...) of each output column
+answer_fields = {
+    "NCT#": "11A",
+    # "Total number of clinical trials": "1A",
+    "Phase": "2A",
+    "Cancer Type": "4A",
+    "Sponsor": "5A",
+    "Findings": "6A",
+    "Conclusions": "7A",
+    "Study Groups": "10A",
+    "Group Info": "Group1-1A",
+    **{f"GroupX{n}": f"Group1-{n}A" for n in range(1, 25)},
+}
+
+# An answer line: optional list/markdown decoration, the answer id, then the answer
+answer_line = re.compile(r"^[\s>*#-]*((?:Group\d+-)?\d+A)\.[*\s]*(.*?)\s*$")
+
+
+# Parse a completion into {answer_id: answer} in a single pass over its lines.
+# Answer ids only count at the start of a line, so "2A." inside "Group1-2A."
+# or "1A." inside "11A." never match. An answer left empty on its own line is
+# taken from the next non-blank line. The first answer for each id wins.
+def parse_answers(content):
+    answers = {}
+    pending = None
+    for line in content.splitlines():
+        match = answer_line.match(line)
+        if match:
+            answer_id, answer = match.groups()
+            pending = None
+            if answer_id not in answers:
+                answers[answer_id] = answer
+                if not answer:
+                    pending = answer_id
+        elif pending and line.strip():
+            answers[pending] = line.strip()
+            pending = None
+    return {answer_id: answer for answer_id, answer in answers.items() if answer}
+
+
+# Build an output row from parsed answers; missing answers become "Not specified"
+def build_trial_record(answers, completion_id):
+    record = {"Trial Identification": f"Trial1-Info:{completion_id}"}
+    for field, answer_id in answer_fields.items():
+        record[field] = answers.get(answer_id, "Not specified")
+    return record
+
+
+# An output row built from a completion whose stream dropped half way: it is
+# kept, but counts as a failure of the model and is journaled as "partial",
+# so a resumed run extracts the trial again
+class PartialRecord(dict):
+    pass
+
+
+# The trial level questions, by answer id
+trial_questions = {
+    "1A": "How many Clinical Trials are there?",
+    "11A": "What is the NCT# Associated with this clinical trial?",
+    "2A": "What Phase is the clinical trial in? Phase 1, Phase 2, Phase 3, or Phase 4?",
+    "3A": "What type of cancer(s) was this trial studying? ie- NSCLC, SCLC, Melanoma, Leukemia, Colon etc",
+    "4A": "Describe the Cancer Type?",
+    "5A": "Who sponsored the clinical trial?",
+    "6A": "What were the novel findings of this trial?",
+    "7A": "What conclusions were reached regarding this clinical trial?",
+    "8A": "Is there any other relevant information that might make this clinical trial unique?",
+    "9A": "Were there any subgroups in this study that the clinical trial identified had heightened responses to the intervention?",
+    "10A": "What are the study groups?",
+}
+
+# The questions asked about every study group, by question number
+group_questions = {
+    1: "Is this the control group or the intervention group?",
+    2: "What drug(s) was the clinical trial studying in this group/cohort?",
+    3: "What was the Treatment ORR in this group/cohort?",
+    4: "What was the Intervention Treatment PFS in this group/cohort?",
+    5: "What was the Intervention Treatment OS in this group/cohort?",
+    6: "What percentage of patients in the intervention group discontinued?",
+    7: "Did the group specifically meet its endpoints? Yes or No or NA",
+    8: "Did the group include patients who had specific stages of cancer? If so, what stages?",
+    9: "Did the group include patients who had targets? (such as mutations, biomarkers, genes, etc.)?",
+    10: "Did the group include patients who had previously taken a specific drug type?",
+    11: "Did the group include patients who had specifically developed resistance to specific drugs? If so, list the drugs.",
+    12: "Did the group include patients who had specifically developed resistance to specific drug types? If so, list the drug types.",
+    13: "Did the group include patients who had brain metastases? Yes or No",
+    14: "Did the group include patients who had previous surgery? Yes or No",
+    15: "Did the group include patients who had “advanced” cancer? Yes or No",
+    16: "Did the group include patients who had “metastatic” cancer? Yes or No",
+    17: "Did the group include patients who were previously untreated?",
+    18: "Did the group include patients who had previously taken a specific drug? If so, list the drugs.",
+    19: "Did the group include patients who had NOT previously taken a specific drug? If so, list the drugs.",
+    20: "Did the group include patients who were receiving 1st, 2nd, 3rd, 4th, 5th, etc. therapy? Please specify.",
+    21: "Was the treatment for this group well tolerated?",
+    22: "Were there specific adverse reactions associated with this group?",
+    23: "Has the intervention drug(s) for this group been approved? Yes, No, or NA",
+    24: "What other efficacy data points were measured? (ie- TTP, DoR, CR, PR, SD, CBR, pCR, etc.)? Give in the format TTP:X, DoR:X, CR:X.",
+}
+
+# Ask for JSON matching answer_schema from models that support structured
+# outputs ("auto"), always ("json") or never ("text")
+llm_output_mode = "auto"
+
+# Stream completions as server-sent events and stop reading as soon as every
+# answer is in (see read_completion_stream)
+llm_streaming = False
+
+# Catalog entries of the available models, by id
+model_info = {}
+
+# Models known to support (or to reject) structured outputs, filled in from
+# the model catalog and from requests that were refused
+structured_output_models = set()
+unstructured_output_models = set()
+
+# Words in the body of a 400 response that say the schema was refused, not
+# the request as a whole
+schema_error_markers = ("response_format", "json_schema", "structured output", "structured_output")
+
+
+# Whether a 400 response refused the structured output format
+def rejected_schema(response):
+    try:
+        body = response.text.lower()
+    except Exception:
+        return False
+    return any(marker in body for marker in schema_error_markers)
+
+# Instructions added to the prompt when JSON is requested
+json_instructions = """
+Return your answers as a JSON object that matches the provided schema instead of the format above.
+Use the answer ids as keys (for example "11A" for the NCT#) and put one object per study group in "groups",
+keyed by question number plus "A" (for example "2A" for Group1-2A). Answer "Not specified" when the data does not say.
+"""
+
+
+# JSON schema for structured outputs: every trial answer, plus one object of
+# answers per study group
+def answer_schema():
+    def answers(ids):
+        return {
+            "type": "object",
+            "properties": {answer_id: {"type": "string", "description": question} for answer_id, question in ids},
+            "required": [answer_id for answer_id, _ in ids],
+            "additionalProperties": False,
+        }
+
+    schema = answers(trial_questions.items())
+    schema["properties"]["groups"] = {
+        "type": "array",
+        "items": answers((f"{n}A", question) for n, question in group_questions.items()),
     }
+    schema["required"].append("groups")
+    return {"name": "clinical_trial_answers", "strict": True, "schema": schema}
+
+
+# Turn a JSON completion into {answer_id: answer} like parse_answers does;
+# returns None if it is not valid JSON
+def decode_json_answers(content):
+    try:
+        data = json.loads(content.strip().removeprefix("```json").removesuffix("```"))
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(data, dict):
+        return None
+    answers = {answer_id: str(answer) for answer_id, answer in data.items() if answer_id != "groups" and answer}
+    for number, group in enumerate(data.get("groups") or [], 1):
+        if isinstance(group, dict):
+            for question_id, answer in group.items():
+                if answer:
+                    answers[f"Group{number}-{question_id}"] = str(answer)
+    return answers
+
 
-    # Including text_data in the message content
-    payload = {
-        "model": selected_model,
-        "messages": [
-            {
-                "role": "user",
-                "content": f"""
-I am giving you text that is intended to have clinical trial results data. 
-Here is the clinical trial data: 
-{text_data}
+# Fixed part of the prompt: the instructions and every question. It goes first,
+# as the system message, so providers can cache it across requests; the
+# abstract follows in the user message.
+prompt_instructions = """
+I am giving you text that is intended to have clinical trial results data.
+The clinical trial data is in the next message.
 
-Depending on the above clinical trial data provided, please answer the following questions and structure the response as outlined below:
+Depending on the clinical trial data provided, please answer the following questions and structure the response as outlined below:
 
 Trial Identification:
 1. How many Clinical Trials are there?
@@ -177,8 +639,199 @@ Group1-23A. [Answer]
 Group1-24. What other efficacy data points were measured? (ie- TTP, DoR, CR, PR, SD, CBR, pCR, etc.)? Give in the format TTP:X, DoR:X, CR:X.
 Group1-24A. [Answer]
 """
-            }
-        ],
+
+# Models whose providers only cache a prompt prefix that is marked with cache_control
+# (others, such as OpenAI and DeepSeek, cache long prefixes automatically)
+cache_control_prefixes = ("anthropic/", "google/gemini")
+
+
+# The messages for one abstract: static instructions first, abstract last
+def build_messages(text_data, selected_model, json_output=False):
+    instructions = prompt_instructions + (json_instructions if json_output else "")
+    if selected_model.startswith(cache_control_prefixes):
+        system = [{"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}]
+    else:
+        system = instructions
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": f"Here is the clinical trial data: \n{text_data}\n"},
+    ]
+
+
+# Whether to request structured JSON output from a model
+def use_json_output(selected_model, output_mode=None):
+    output_mode = output_mode or llm_output_mode
+    if output_mode == "auto":
+        return selected_model in structured_output_models and selected_model not in unstructured_output_models
+    return output_mode == "json"
+
+
+# Fetch specific trial information (with retries for resilience)
+# With refresh_cache=True a cached completion is ignored and replaced.
+# output_mode overrides llm_output_mode ("auto", "json" or "text").
+def call_llm_api(text_data, selected_model, refresh_cache=False, output_mode=None):
+    try:
+        return extract_trial(text_data, selected_model, refresh_cache, output_mode)
+    except requests.exceptions.HTTPError as err:
+        print(f"HTTP error occurred: {err}")
+        print(f"Response content: {err.response.text}")  # Print the error response for more context
+        return None
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+
+
+# Extract one trial's answers with one model. Unlike call_llm_api, errors
+# are raised so the caller can tell a rate limit from a bad request.
+# on_latency is called with the time the API took to answer, if it was asked;
+# park=False fails at once instead of waiting while the model's breaker is
+# open, and setting the `cancel` event abandons the request (see hedge.py).
+# attempts overrides how often the request is tried (see request_completion).
+def extract_trial(
+    text_data, selected_model, refresh_cache=False, output_mode=None, on_latency=None, park=True, cancel=None,
+    attempts=None,
+):
+    json_output = use_json_output(selected_model, output_mode)
+
+    # Never send more than the model's context window can take
+    budget = token_budget(selected_model)
+    room = budget.prompt_room(budget.tokens(prompt_instructions + (json_instructions if json_output else "")))
+    if budget.tokens(text_data) > room:
+        print(f"Abstract is too long for {selected_model}, truncating it")
+        text_data = budget.truncate(text_data, room)
+
+    payload = {"model": selected_model, "messages": build_messages(text_data, selected_model, json_output)}
+    if json_output:
+        payload["response_format"] = {"type": "json_schema", "json_schema": answer_schema()}
+
+    try:
+        # JSON answers are only usable once complete, so only text is cut short
+        is_complete = None if json_output else answers_complete
+        structured_data, content = request_completion(
+            payload, refresh_cache, on_latency, park, cancel, is_complete=is_complete, attempts=attempts
+        )
+    except requests.exceptions.HTTPError as err:
+        if json_output and err.response.status_code == 400 and rejected_schema(err.response):
+            # The model (or its provider) refused the schema: ask again for text
+            print(f"{selected_model} rejected structured output, retrying with the text format")
+            unstructured_output_models.add(selected_model)
+            return extract_trial(text_data, selected_model, refresh_cache, "text", on_latency, park, cancel, attempts)
+        raise
+
+    # Decode the JSON answer, or parse every answer line in one pass,
+    # and map the answers onto the output columns
+    answers = decode_json_answers(content) if json_output else None
+    if json_output and answers is None:
+        print("Response was not valid JSON, falling back to the text parser")
+    if answers is None:
+        answers = parse_answers(content)
+    record = build_trial_record(answers, structured_data.get("id"))
+    return PartialRecord(record) if stream_dropped(structured_data) else record
+
+
+# Record a failed request to one of the router's models. Returns whether
+# another model is worth trying (not after a request error, another 4xx).
+# Only failover statuses and transport errors count against the model: a
+# request error is the request's fault, and a breaker.BreakerOpen was
+# already counted by the breaker.
+def routed_failure(model_router, model, error):
+    if isinstance(error, requests.exceptions.HTTPError):
+        if not router.should_fail_over(error.response.status_code):
+            print(f"HTTP error occurred: {error}")
+            print(f"Response content: {error.response.text}")
+            return False
+        model_router.failure(model)
+        return True
+    if isinstance(error, requests.exceptions.RequestException):
+        model_router.failure(model)
+    print(f"An error occurred with {model}: {error}")
+    return True
+
+
+# Extract one trial with one of the router's models, recording the outcome.
+# Returns (record, fail_over): fail_over says whether another model is worth
+# trying after a failure (see routed_failure).
+def try_model(text_data, model_router, model, refresh_cache=False, park=True, cancel=None, attempts=None):
+    latencies = []
+    try:
+        record = extract_trial(
+            text_data, model, refresh_cache, on_latency=latencies.append, park=park, cancel=cancel,
+            attempts=attempts,
+        )
+    except hedge.Cancelled:
+        return None, False
+    except Exception as e:
+        return None, routed_failure(model_router, model, e)
+    if isinstance(record, PartialRecord):
+        model_router.failure(model)
+    else:
+        model_router.success(model, latencies[0] if latencies else None)
+    return record, False
+
+
+# Extract one trial with the best model the router offers, moving on to the
+# next one on rate limits, server errors, dropped connections and unusable
+# responses. Models whose circuit breaker is open come last, so the request
+# is only parked on one once every other model has failed. Returns None once
+# they all have, or on a request error (another 4xx) that no other model
+# would do better with.
+def route_llm_call(text_data, model_router, refresh_cache=False):
+    prompt_tokens = packing.estimate_tokens(prompt_instructions + text_data)
+    ranked = model_router.rank(prompt_tokens, packing.answer_tokens_per_trial)
+    for model in ranked:
+        # Only wait out an open breaker, or retry a rate limit or server error
+        # on the same model, with nowhere left to fail over to
+        last = model == ranked[-1]
+        record, fail_over = try_model(
+            text_data, model_router, model, refresh_cache, park=last, attempts=None if last else 1
+        )
+        if record or not fail_over:
+            return record
+    print("Every model failed for this trial")
+    return None
+
+
+# Extract one trial with the router's best model, hedged: if it has not
+# answered within its p95 latency, the same abstract also goes to the next
+# best model (or again to the same one, which OpenRouter may serve from
+# another provider) and the first usable answer wins. If both fail, the
+# trial is routed as usual, so neither request is retried on its own.
+def hedged_llm_call(text_data, model_router, hedger, refresh_cache=False):
+    prompt_tokens = packing.estimate_tokens(prompt_instructions + text_data)
+    ranked = model_router.rank(prompt_tokens, packing.answer_tokens_per_trial)
+    primary = ranked[0]
+    secondary = ranked[1] if len(ranked) > 1 else primary
+
+    def attempt(model):
+        return lambda cancel: try_model(
+            text_data, model_router, model, refresh_cache, park=False, cancel=cancel, attempts=1
+        )[0]
+
+    delay = model_router.latency_percentile(primary, hedge.percentile, hedge.min_samples) or hedge.default_delay
+    cost = model_router.price(secondary, prompt_tokens, packing.answer_tokens_per_trial)
+    record = hedger.run(attempt(primary), attempt(secondary), delay, cost)
+    return record or route_llm_call(text_data, model_router, refresh_cache)
+
+
+# Send a chat completion request (or answer it from the LLM cache).
+# Returns the response data and the completion text; raises on HTTP errors.
+# on_latency, if given, is called with the seconds the API took to answer.
+# While the model's circuit breaker is open the request is parked, or with
+# park=False, fails with breaker.BreakerOpen. Once the `cancel` event is set
+# the request is not sent (again), or its stream is closed, and
+# hedge.Cancelled is raised. With stream=True (by default llm_streaming) the
+# completion is streamed and cut off once is_complete(content) is true.
+# attempts overrides retry.llm_policy's; routed requests with another model
+# to fail over to pass 1, so a 429 or 5xx moves on at once.
+def request_completion(
+    payload, refresh_cache=False, on_latency=None, park=True, cancel=None, stream=None, is_complete=None,
+    attempts=None,
+):
+    if stream is None:
+        stream = llm_streaming
+    headers = {
+        "Authorization": f"Bearer {llm_api_key}",
+        "Content-Type": "application/json",
     }
 
     # Print the entire payload to debug the message being sent
@@ -186,184 +839,493 @@ Group1-24A. [Answer]
     print("Payload being sent to LLM API:")
     print(json.dumps(payload, indent=4))  # Pretty-print the payload for better readability
 
-    try:
-        response = requests.post(llm_api_url, headers=headers, data=json.dumps(payload))
+    store = llm_cache()
+    structured_data = store.get_completion(payload) if store and not refresh_cache else None
+    from_cache = structured_data is not None
+    if from_cache:
+        print("Using cached response for this model and prompt")
+    else:
+        # The model's circuit breaker parks the request while the model is
+        # failing, and the adaptive limiter decides how many may be in flight
+        model = payload["model"]
+        received = {}
+
+        def send():
+            breaker.llm_breakers.acquire(model, breaker.max_park if park else 0)
+            started = concurrency.llm_limiter.acquire(model)
+            if cancel and cancel.is_set():
+                concurrency.llm_limiter.release(model, started)
+                breaker.llm_breakers.record(model, None)
+                raise hedge.Cancelled()
+            outcome = {}
+            healthy = None
+            try:
+                if stream:
+                    body = json.dumps({**payload, "stream": True})
+                    response = transport.open_stream("POST", llm_api_url, headers=headers, data=body)
+                    if response.status_code < 400:
+                        # The slot is held until the stream is read
+                        received["data"] = read_completion_stream(response, is_complete, cancel)
+                    else:
+                        transport.read(response)
+                else:
+                    response = transport.post(llm_api_url, headers=headers, data=json.dumps(payload))
+                received["latency"] = time.monotonic() - started
+                if stream and stream_dropped(received.get("data")):
+                    # Answered in part, but the connection dropped all the same
+                    healthy = False
+                    return response
+                outcome = {
+                    "success": response.status_code < 400,
+                    "congested": response.status_code in concurrency.congestion_statuses,
+                    "retry_after": retry.retry_after_seconds(response.headers),
+                }
+                if response.status_code < 400:
+                    healthy = True
+                elif response.status_code in router.failover_statuses:
+                    healthy = False
+                return response
+            except requests.exceptions.Timeout:
+                outcome = {"congested": True}
+                healthy = False
+                raise
+            except requests.exceptions.ConnectionError:
+                healthy = False
+                raise
+            finally:
+                concurrency.llm_limiter.release(model, started, **outcome)
+                breaker.llm_breakers.record(model, healthy)
+
+        response = retry.llm_policy.call(send, f"completion from {model}", attempts)
         response.raise_for_status()  # Raises HTTPError for bad responses
-        structured_data = response.json()
-        print("\n\n\n\n\n")  # Five blank lines
-        print(f"Response data from the API: {structured_data}")  # Print the error response for more context
-
-        # Extract content from the response
-        content = structured_data['choices'][0]['message']['content']
-        print(f"Content from inside response: {content}")  # Print the error response for more context
-
-        # Function to safely extract data using regex
-        def safe_search(pattern, string):
-            match = re.search(pattern, string)
-            if match:
-                return match.group(1)
-            return "Not specified"  # Default value if not found
-
-        # Regular expressions to find required data
-        # nct_number = safe_search(r"1A\.\s*(.+)", content)
-        nct_numberr = safe_search(r"11A\.\s*(.+)", content)
-        phase = safe_search(r"2A\.\s*(.+)", content)
-        cancer_type = safe_search(r"4A\.\s*(.+)", content)
-        sponsor = safe_search(r"5A\.\s*(.+)", content)
-        findings = safe_search(r"6A\.\s*(.+)", content)
-        conclusions = safe_search(r"7A\.\s*(.+)", content)
-
-        # Group questions extraction
-        study_groups = safe_search(r"10A\.\s*(.+)", content)
-        group_info = safe_search(r"Group1-1A\.\s*(.+)", content)
-        groupX1 = safe_search(r"Group1-1A\.\s*(.+)", content)
-        groupX2 = safe_search(r"Group1-2A\.\s*(.+)", content)
-        groupX3 = safe_search(r"Group1-3A\.\s*(.+)", content)
-        groupX4 = safe_search(r"Group1-4A\.\s*(.+)", content)
-        groupX5 = safe_search(r"Group1-5A\.\s*(.+)", content)
-        groupX6 = safe_search(r"Group1-6A\.\s*(.+)", content)
-        groupX7 = safe_search(r"Group1-7A\.\s*(.+)", content)
-        groupX8 = safe_search(r"Group1-8A\.\s*(.+)", content)
-        groupX9 = safe_search(r"Group1-9A\.\s*(.+)", content)
-        groupX10 = safe_search(r"Group1-10A\.\s*(.+)", content)
-        groupX11 = safe_search(r"Group1-11A\.\s*(.+)", content)
-        groupX12 = safe_search(r"Group1-12A\.\s*(.+)", content)
-        groupX13 = safe_search(r"Group1-13A\.\s*(.+)", content)
-        groupX14 = safe_search(r"Group1-14A\.\s*(.+)", content)
-        groupX15 = safe_search(r"Group1-15A\.\s*(.+)", content)
-        groupX16 = safe_search(r"Group1-16A\.\s*(.+)", content)
-        groupX17 = safe_search(r"Group1-17A\.\s*(.+)", content)
-        groupX18 = safe_search(r"Group1-18A\.\s*(.+)", content)
-        groupX19 = safe_search(r"Group1-19A\.\s*(.+)", content)
-        groupX20 = safe_search(r"Group1-20A\.\s*(.+)", content)
-        groupX21 = safe_search(r"Group1-21A\.\s*(.+)", content)
-        groupX22 = safe_search(r"Group1-22A\.\s*(.+)", content)
-        groupX23 = safe_search(r"Group1-23A\.\s*(.+)", content)
-        groupX24 = safe_search(r"Group1-24A\.\s*(.+)", content)
-
-
-
-
-        # Return structured data
-        return {
-            "Trial Identification": f"Trial1-Info:{structured_data.get('id')}",
-            "NCT#": nct_numberr,
-            # "Total number of clinical trials" : nct_number,
-            "Phase": phase,
-            "Cancer Type": cancer_type,
-            "Sponsor": sponsor,
-            "Findings": findings,
-            "Conclusions": conclusions,
-            "Study Groups": study_groups,
-            "Group Info": group_info,
-            "GroupX1" : groupX1,
-            "GroupX2" : groupX2,
-            "GroupX3" : groupX3,
-            "GroupX4" : groupX4,
-            "GroupX5" : groupX5,
-            "GroupX6" : groupX6,
-            "GroupX7" : groupX7,
-            "GroupX8" : groupX8,
-            "GroupX9" : groupX9,
-            "GroupX10" : groupX10,
-            "GroupX11" : groupX11,
-            "GroupX12" : groupX12,
-            "GroupX13" : groupX13,
-            "GroupX14" : groupX14,
-            "GroupX15" : groupX15,
-            "GroupX16" : groupX16,
-            "GroupX17" : groupX17,
-            "GroupX18" : groupX18,
-            "GroupX19" : groupX19,
-            "GroupX20" : groupX20,
-            "GroupX21" : groupX21,
-            "GroupX22" : groupX22,
-            "GroupX23" : groupX23,
-            "GroupX24" : groupX24,
-
-            # Add more extracted group data here if needed
-        }
+        structured_data = received["data"] if stream else response.json()
+        if on_latency:
+            on_latency(received["latency"])
+    print("\n\n\n\n\n")  # Five blank lines
+    print(f"Response data from the API: {structured_data}")  # Print the error response for more context
+
+    # Extract content from the response
+    content = structured_data['choices'][0]['message']['content']
+    print(f"Content from inside response: {content}")  # Print the error response for more context
+    # A stream that dropped half way holds only some of the answers
+    if store and content and not from_cache and not stream_dropped(structured_data):
+        store.put_completion(payload, structured_data)
+    return structured_data, content
+
+
+# Read a streamed chat completion (server-sent events) as it arrives, and
+# stop as soon as is_complete(content so far) says every answer is in, so
+# the model is not paid for whatever it writes after them. If the
+# connection drops after some content came in, that content is kept (with
+# finish_reason "dropped"). Returns response data shaped like a non-streamed
+# completion.
+def read_completion_stream(response, is_complete=None, cancel=None):
+    data = {"id": None, "model": None, "usage": None}
+    parts = []
+    finish_reason = None
+    try:
+        for line in transport.iter_lines(response):
+            if cancel and cancel.is_set():
+                raise hedge.Cancelled()
+            # Blank lines end events; lines starting with ":" are keep-alive comments
+            if not line or not line.startswith("data:"):
+                continue
+            event = line[len("data:") :].strip()
+            if event == "[DONE]":
+                break
+            event = json.loads(event)
+            if "error" in event:
+                raise RuntimeError(f"Stream error: {event['error']}")
+            data["id"] = data["id"] or event.get("id")
+            data["model"] = data["model"] or event.get("model")
+            data["usage"] = event.get("usage") or data["usage"]
+            for choice in event.get("choices", [])[:1]:
+                finish_reason = choice.get("finish_reason") or finish_reason
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    parts.append(delta)
+                    # Answers only change when a line is finished
+                    if is_complete and "\n" in delta and is_complete("".join(parts)):
+                        print("Every answer is in, closing the stream")
+                        finish_reason = "complete"
+                        return _stream_data(data, parts, finish_reason)
+    except hedge.Cancelled:
+        raise
+    except Exception as e:
+        if not parts:
+            raise
+        print(f"Stream dropped after {len(''.join(parts))} characters, keeping the answers received: {e}")
+        finish_reason = "dropped"
+    finally:
+        response.close()
+    return _stream_data(data, parts, finish_reason)
+
+
+def _stream_data(data, parts, finish_reason):
+    message = {"role": "assistant", "content": "".join(parts)}
+    return {**data, "choices": [{"message": message, "finish_reason": finish_reason}]}
+
+
+# Whether response data comes from a stream that dropped half way
+def stream_dropped(structured_data):
+    choices = (structured_data or {}).get("choices") or [{}]
+    return choices[0].get("finish_reason") == "dropped"
+
+
+# Whether a completion (possibly cut short) already holds every answer.
+# Only finished lines count, as the last one may still be growing.
+def answers_complete(content):
+    answers = parse_answers(content[: content.rfind("\n") + 1])
+    return all(answer_id in answers for answer_id in answer_fields.values())
+
+
+# Whether a batch completion already holds every answer for every trial
+def batch_answers_complete(content, trial_ids):
+    sections = batch_delimiter.split(content[: content.rfind("\n") + 1])
+    found = {}
+    for trial_id, section in zip(sections[1::2], sections[2::2]):
+        found.setdefault(trial_id, section)
+    return all(trial_id in found and answers_complete(found[trial_id]) for trial_id in trial_ids)
+
+
+# Instructions added when several abstracts share one request
+batch_instructions = """
+The next message holds several clinical trial abstracts. Each one starts with a line of the form
+=== PMID <number> ===
+Answer all of the questions above separately for every abstract. Start the answers for each abstract with
+its own === PMID <number> === line, followed by the answers in the format shown above.
+"""
+
+# A PMID delimiter line, in the request and in the response
+batch_delimiter = re.compile(r"^[\s*#]*=== PMID (\d+) ===[\s*]*$", re.MULTILINE)
+
+
+# Send several abstracts in one request and parse the answers. items is
+# [(trial_id, text)]; returns ({trial_id: record} for the abstracts the
+# response answers in full, whether the stream dropped half way). Raises on HTTP and
+# other errors; on_latency, park and attempts are as for request_completion.
+# Batches always use the text answer format.
+def extract_batch(items, selected_model, refresh_cache=False, on_latency=None, park=True, attempts=None):
+    abstracts = "\n".join(f"=== PMID {trial_id} ===\n{text_data}" for trial_id, text_data in items)
+    messages = build_messages(abstracts, selected_model)
+    messages[0]["content"] = _append_text(messages[0]["content"], batch_instructions)
+    payload = {"model": selected_model, "messages": messages}
+
+    trial_ids = [trial_id for trial_id, _ in items]
+    structured_data, content = request_completion(
+        payload, refresh_cache, on_latency, park,
+        is_complete=lambda content: batch_answers_complete(content, trial_ids), attempts=attempts,
+    )
+    dropped = stream_dropped(structured_data)
+    if not dropped:
+        # The last line of a finished completion is whole even without a newline
+        content += "\n"
+    results = {}
+    sections = batch_delimiter.split(content)
+    # split() gives [preamble, id1, answers1, id2, answers2, ...]. A section
+    # missing answers (cut short, or skipped by the model) is left to the
+    # single abstract fallback rather than filled with "Not specified".
+    for trial_id, section in zip(sections[1::2], sections[2::2]):
+        if trial_id not in results and answers_complete(section):
+            results[trial_id] = build_trial_record(parse_answers(section), f"{structured_data.get('id')}:{trial_id}")
+    return results, dropped
+
+
+# Extract several trials with one request; returns {trial_id: record or None}.
+# The shared instructions are sent once for the whole batch, and every
+# abstract whose answers are missing from the response is retried on its own
+# with `fallback` (call_llm_api with the same model by default).
+def call_llm_api_batch(items, selected_model, refresh_cache=False, fallback=None):
+    if fallback is None:
+        fallback = lambda text_data: call_llm_api(text_data, selected_model, refresh_cache)
+    if len(items) == 1:
+        trial_id, text_data = items[0]
+        return {trial_id: fallback(text_data)}
+
+    results = {}
+    try:
+        results, _ = extract_batch(items, selected_model, refresh_cache)
     except requests.exceptions.HTTPError as err:
-        print(f"HTTP error occurred: {err}")
-        print(f"Response content: {response.text}")  # Print the error response for more context
-        return None
+        print(f"HTTP error occurred for a batch of {len(items)} trials: {err}")
     except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+        print(f"An error occurred for a batch of {len(items)} trials: {e}")
 
+    for trial_id, text_data in items:
+        if trial_id not in results:
+            print(f"No answers for trial ID {trial_id} in the batch response, extracting it on its own")
+            results[trial_id] = fallback(text_data)
+    return {trial_id: results[trial_id] for trial_id, _ in items}
 
-# Save extracted data to CSV
-def save_to_csv(trial_data, filename="clinical_trials.csv"):
-    if trial_data:
-        fieldnames = [
-            "Trial Identification",
-            "NCT#",
-            # "Total number of clinical trials",
-            "Phase",
-            "Cancer Type",
-            "Sponsor",
-            "Findings",
-            "Conclusions",
-            "Study Groups",
-            "Group Info",
-            "GroupX1",
-            "GroupX2",
-            "GroupX3",
-            "GroupX4",
-            "GroupX5",
-            "GroupX6",
-            "GroupX7",
-            "GroupX8",            
-            "GroupX9",
-            "GroupX10",
-            "GroupX11",
-            "GroupX12",
-            "GroupX13",
-            "GroupX14",
-            "GroupX15",
-            "GroupX16",
-            "GroupX17",
-            "GroupX18",
-            "GroupX19",
-            "GroupX20",
-            "GroupX21",
-            "GroupX22",
-            "GroupX23",
-            "GroupX24",
-            
-        ]
-        with open(filename, mode="w", newline="") as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(trial_data)
-        print(f"\nData has been saved to {filename}")
+
+# Extract a batch with one of the router's models, recording the outcome.
+# Returns (results, fail_over) as extract_batch's results and try_model's
+# fail_over; a dropped stream counts as a failure of the model.
+def try_batch(items, model_router, model, refresh_cache=False, park=True, attempts=None):
+    latencies = []
+    try:
+        results, dropped = extract_batch(items, model, refresh_cache, latencies.append, park, attempts)
+    except Exception as e:
+        print(f"Batch of {len(items)} trials failed with {model}")
+        return {}, routed_failure(model_router, model, e)
+    if dropped:
+        model_router.failure(model)
     else:
-        print("No trial data to save.")
+        model_router.success(model, latencies[0] if latencies else None)
+    return results, False
+
+
+# Extract several trials with the router's models, failing over the way
+# route_llm_call does: the batch goes to the best model, split to fit its
+# context window (and `limit`), and whatever a failed request held moves
+# on to the next model. Abstracts no batch answered are routed one by one.
+# Returns {trial_id: record or None}.
+def route_llm_batch(items, model_router, limit=None, refresh_cache=False):
+    prompt_tokens = sum(packing.estimate_tokens(text_data) for _, text_data in items)
+    ranked = model_router.rank(prompt_tokens, len(items) * packing.answer_tokens_per_trial)
+    results = {}
+    pending = list(items)
+    for model in ranked:
+        last = model == ranked[-1]
+        failed = set()
+        for packed in pack_abstracts(pending, model, limit):
+            if len(packed) == 1:
+                # Routed on its own below
+                continue
+            answered, fail_over = try_batch(
+                packed, model_router, model, refresh_cache, park=last, attempts=None if last else 1
+            )
+            results.update(answered)
+            if fail_over:
+                failed.update(trial_id for trial_id, _ in packed if trial_id not in answered)
+        # Packed again for the next model from the abstracts as they came, untruncated
+        pending = [item for item in pending if item[0] in failed]
+        if not pending:
+            break
+
+    for trial_id, text_data in items:
+        if trial_id not in results:
+            print(f"No answers for trial ID {trial_id} from a batch, routing it on its own")
+            results[trial_id] = route_llm_call(text_data, model_router, refresh_cache)
+    return {trial_id: results[trial_id] for trial_id, _ in items}
+
+
+# Split [(trial_id, text)] into batches sized for the model's context window
+# and completion limit, with at most `limit` abstracts in each
+def pack_abstracts(items, selected_model, limit=None):
+    budget = token_budget(selected_model)
+    return packing.pack(items, budget, budget.tokens(prompt_instructions + batch_instructions), limit)
+
+
+# Add text to a message content that may be a string or a list of parts
+def _append_text(content, text):
+    if isinstance(content, str):
+        return content + text
+    return [{**content[0], "text": content[0]["text"] + text}, *content[1:]]
+
+
+# Columns of the output file, in order
+trial_fieldnames = [
+    "Trial Identification",
+    "PMID",
+    "NCT#",
+    # "Total number of clinical trials",
+    "Phase",
+    "Cancer Type",
+    "Sponsor",
+    "Findings",
+    "Conclusions",
+    "Study Groups",
+    "Group Info",
+    "GroupX1",
+    "GroupX2",
+    "GroupX3",
+    "GroupX4",
+    "GroupX5",
+    "GroupX6",
+    "GroupX7",
+    "GroupX8",
+    "GroupX9",
+    "GroupX10",
+    "GroupX11",
+    "GroupX12",
+    "GroupX13",
+    "GroupX14",
+    "GroupX15",
+    "GroupX16",
+    "GroupX17",
+    "GroupX18",
+    "GroupX19",
+    "GroupX20",
+    "GroupX21",
+    "GroupX22",
+    "GroupX23",
+    "GroupX24",
+]
 
 
 # Main script execution
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract clinical trial data from PubMed abstracts")
+    parser.add_argument(
+        "--resume", action="store_true", help="continue the run recorded in the journal, skipping finished trials"
+    )
+    parser.add_argument("--keyword", help="clinical trial keyword to search for (asked for if missing)")
+    parser.add_argument("--max-trials", type=int, help="most trials to process (asked for if missing)")
+    parser.add_argument(
+        "--model",
+        help='model id, or a filter such as "cheapest text context>=32k" (see catalog.ModelIndex.select); '
+        "asked for if missing",
+    )
+    parser.add_argument(
+        "--fallback-model",
+        action="append",
+        default=[],
+        help="another model id or filter to route requests to; each request goes to the cheapest, fastest "
+        "healthy model, failing over on rate limits and server errors (may be given more than once)",
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="if a request takes longer than its model's p95 latency, send it to the next model as well "
+        "and keep the first answer",
+    )
+    parser.add_argument(
+        "--hedge-rate",
+        type=float,
+        default=hedge.max_hedge_rate,
+        help="largest fraction of requests that may be hedged",
+    )
+    parser.add_argument("--hedge-budget", type=float, help="most dollars to spend on hedged requests")
+    parser.add_argument("--journal", default=journal.journal_path, help="progress journal file")
+    parser.add_argument("--output", default="clinical_trials.csv", help="file the trials are written to")
+    parser.add_argument(
+        "--format",
+        choices=writers.output_formats,
+        help="output format (by default taken from the --output extension: .csv, .parquet, .arrow/.feather)",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=writers.write_modes,
+        default="overwrite",
+        help="replace the output file, append to it, or append only trials it does not hold yet (CSV only)",
+    )
+    parser.add_argument(
+        "--llm-output",
+        choices=("auto", "json", "text"),
+        default=llm_output_mode,
+        help="ask for JSON answers (auto: only from models that support structured outputs) or the text format",
+    )
+    parser.add_argument(
+        "--llm-batch",
+        type=int,
+        default=1,
+        help="most abstracts to extract per LLM request, 0 to fit as many as the model's context allows "
+        "(batches use the text format)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="stream completions and stop each one as soon as every answer is in",
+    )
+    parser.add_argument(
+        "--refresh-llm-cache",
+        action="store_true",
+        help="request every completion again, replacing the ones in the LLM cache",
+    )
+    parser.add_argument(
+        "--no-llm-cache", action="store_true", help="neither read nor write the LLM completion cache"
+    )
+    parser.add_argument(
+        "--http2",
+        action="store_true",
+        help="reach the LLM API over HTTP/2, multiplexing requests on fewer connections (requires httpx[http2])",
+    )
+    args = parser.parse_args()
+    llm_output_mode = args.llm_output
+    llm_streaming = args.stream
+    use_llm_cache = not args.no_llm_cache
+    if args.http2:
+        transport.configure(http2=transport.http2_hosts | {urlsplit(llm_api_url).netloc})
+
+    # A resumed run takes its keyword, size and model from the journal
+    run_journal = journal.Journal(args.journal, resume=args.resume)
+    run = run_journal.run
+    if run:
+        print(f"Resuming run for '{run['keyword']}' with {run['model']} ({len(run_journal.results)} trials done)")
+
+    # Example search keyword
+    keyword = run.get("keyword") or args.keyword or input("Enter the clinical trial keyword (e.g., Breast Cancer): ")
+
+    # Count the results first so the size of the run is known up front
+    limit = run.get("limit") or args.max_trials
+    result_count = None
+    if limit is None:
+        result_count = count_pubmed_results(keyword)
+        print(f"Found {result_count} matching trials")
+        max_trials = input("Enter the maximum number of trials to process (press Enter for all): ")
+        limit = int(max_trials) if max_trials.strip() else result_count
+
     models = check_available_models()  # Check available models first
     if models:
-        selected_model = choose_model(models)  # Let user select a model
-        all_trials = []
-        for page in range(total_pages):
-            xml_data = fetch_pubmed_results(keyword, page)
-            if xml_data:
-                # Parse trial IDs
-                trial_ids = parse_trial_ids(xml_data)
-                print(f"Parsed trial IDs for page {page + 1}: {trial_ids}")
-                for trial_id in trial_ids:
-                    trial_info = fetch_trial_info(trial_id)
-                    if trial_info:
-                        print(f"\nFetched trial info for ID {trial_id}:")
-                        print(trial_info)
-                        structured_data = call_llm_api(trial_info, selected_model)
-                        if structured_data:
-                            print(f"Structured data for trial ID {trial_id}: {structured_data}")
-                            all_trials.append(structured_data)
-
-        # Save to CSV
-        save_to_csv(all_trials)
+        index = catalog.ModelIndex(models)
+        selected_model = run.get("model")
+        if not selected_model and args.model:
+            try:
+                selected_model = index.select(args.model)
+            except ValueError as e:
+                sys.exit(str(e))
+            if not selected_model:
+                sys.exit(f"No model matches '{args.model}'")
+            print(f"Selected model {selected_model} for '{args.model}'")
+        if not selected_model:
+            selected_model = choose_model(models)  # Let user select a model
+        fallback_models = run.get("fallback_models")
+        if fallback_models is None:
+            fallback_models = []
+            for spec in args.fallback_model:
+                try:
+                    fallback_model = index.select(spec)
+                except ValueError as e:
+                    sys.exit(str(e))
+                if not fallback_model:
+                    sys.exit(f"No model matches '{spec}'")
+                fallback_models.append(fallback_model)
+        model_router = None
+        if fallback_models or args.hedge:
+            model_router = router.ModelRouter([selected_model] + fallback_models, index)
+            print(f"Routing requests between {', '.join(model_router.models)}")
+        hedger = hedge.Hedger(args.hedge_rate, args.hedge_budget) if args.hedge else None
+        run_journal.start(
+            {"keyword": keyword, "limit": limit, "model": selected_model, "fallback_models": fallback_models}
+        )
+        # Search, fetch and LLM stages run concurrently (see pipeline.py).
+        # pipeline.py imports this script as "ai"; make that the running
+        # module so both share the same settings and caches.
+        sys.modules.setdefault("ai", sys.modules[__name__])
+        from pipeline import run_pipeline
+
+        # Each trial is written out as soon as it is extracted
+        try:
+            writer = writers.open_writer(args.output, trial_fieldnames, args.format, args.mode)
+        except ValueError as e:
+            sys.exit(str(e))
+        with writer:
+            asyncio.run(
+                run_pipeline(
+                    keyword,
+                    limit,
+                    selected_model,
+                    llm_batch=args.llm_batch,
+                    journal=run_journal,
+                    writer=writer,
+                    model_router=model_router,
+                    hedger=hedger,
+                    refresh_cache=args.refresh_llm_cache,
+                    result_count=result_count,
+                )
+            )
+        if hedger:
+            hedger.close()
+        run_journal.close()
     else:
         print("No models available, cannot proceed.")
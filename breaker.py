@@ -0,0 +1,146 @@
+import threading
+import time
+
+# Failures in a row that open a model's breaker, and a provider's (the
+# provider's counts the failures of all of its models)
+failure_threshold = 5
+provider_failure_threshold = 10
+
+# Seconds an open breaker waits before letting one trial request through
+reset_timeout = 60.0
+
+# Longest a request waits (parked) for a breaker to let it through
+max_park = 600.0
+
+
+class BreakerOpen(Exception):
+    pass
+
+
+# Circuit breaker of one model or provider. Closed: requests go through and
+# failures in a row are counted. Open, after `threshold` of them: requests
+# are held back. Half-open, `reset_timeout` seconds later: a single trial
+# request goes through, and closes the breaker if it succeeds or opens it
+# again if it fails. Not locked on its own; BreakerBoard serializes access.
+class CircuitBreaker:
+    def __init__(self, name, threshold=failure_threshold, timeout=reset_timeout):
+        self.name = name
+        self.threshold = threshold
+        self.timeout = timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.opens = 0
+
+    # When an open breaker goes half-open
+    def retry_at(self):
+        return self.opened_at + self.timeout if self.state == "open" else 0.0
+
+    # Whether a request may go through now
+    def ready(self, now):
+        if self.state == "open" and now >= self.retry_at():
+            self.state = "half-open"
+            print(f"Circuit breaker for {self.name} is half-open, sending a trial request")
+        if self.state == "half-open":
+            return not self.probing
+        return self.state == "closed"
+
+    def take(self):
+        if self.state == "half-open":
+            self.probing = True
+
+    def success(self):
+        if self.state != "closed":
+            print(f"Circuit breaker for {self.name} closed")
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == "half-open" or (self.state == "closed" and self.failures >= self.threshold):
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self.opens += 1
+            print(f"Circuit breaker for {self.name} opened after {self.failures} failures")
+
+    # The request ended in a way that says nothing about the model's health
+    def neutral(self):
+        self.probing = False
+
+
+# Circuit breakers of every model and provider. A request to a model must
+# get through both the model's breaker and its provider's.
+class BreakerBoard:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.breakers = {}
+
+    def _breakers(self, model):
+        provider = model.split("/", 1)[0] + "/*"
+        if model not in self.breakers:
+            self.breakers[model] = CircuitBreaker(model)
+        if provider not in self.breakers:
+            self.breakers[provider] = CircuitBreaker(provider, provider_failure_threshold)
+        return self.breakers[model], self.breakers[provider]
+
+    # Whether a request to the model would go through now
+    def available(self, model):
+        with self.condition:
+            now = time.monotonic()
+            return all(breaker.ready(now) for breaker in self._breakers(model))
+
+    # When a request to the model will go through again (0 if it would now)
+    def retry_at(self, model):
+        with self.condition:
+            return max(breaker.retry_at() for breaker in self._breakers(model))
+
+    # Wait until the model's breakers let a request through. Raises
+    # BreakerOpen if that takes longer than `timeout` seconds.
+    def acquire(self, model, timeout=max_park):
+        give_up_at = time.monotonic() + timeout
+        parked = False
+        with self.condition:
+            breakers = self._breakers(model)
+            while True:
+                now = time.monotonic()
+                if all(breaker.ready(now) for breaker in breakers):
+                    for breaker in breakers:
+                        breaker.take()
+                    return
+                if now >= give_up_at:
+                    raise BreakerOpen(f"Circuit breaker for {model} is open")
+                if not parked:
+                    print(f"Circuit breaker for {model} is open, parking the request")
+                    parked = True
+                # Wake up when a breaker goes half-open, or a trial request ends
+                retry_at = max(breaker.retry_at() for breaker in breakers)
+                self.condition.wait(max(0.0, min(retry_at or give_up_at, give_up_at) - now))
+
+    # Record how a request let through by acquire() ended: True for a
+    # response, False for a failure that counts against the model (see
+    # router.should_fail_over), None for anything else
+    def record(self, model, ok):
+        with self.condition:
+            for breaker in self._breakers(model):
+                if ok:
+                    breaker.success()
+                elif ok is None:
+                    breaker.neutral()
+                else:
+                    breaker.failure()
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                name: {"state": breaker.state, "opens": breaker.opens}
+                for name, breaker in self.breakers.items()
+                if breaker.opens
+            }
+
+
+# Shared by every LLM request of the run
+llm_breakers = BreakerBoard()
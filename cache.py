@@ -0,0 +1,164 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+# Defaults for the on-disk abstract cache
+abstract_cache_path = "abstract_cache.sqlite"
+abstract_cache_ttl = 90 * 24 * 3600  # PubMed abstracts rarely change
+abstract_cache_max_bytes = 512 * 1024 * 1024
+
+# Defaults for the LLM completion cache (completions never go stale by themselves)
+llm_cache_path = "llm_cache.sqlite"
+llm_cache_ttl = None
+llm_cache_max_bytes = 1024 * 1024 * 1024
+
+# Keys per query, well below SQLite's limit on query parameters
+_chunk_size = 500
+
+
+def _chunks(keys):
+    for start in range(0, len(keys), _chunk_size):
+        yield keys[start : start + _chunk_size]
+
+
+# Key/value store in a single SQLite file. Values are zlib-compressed text,
+# entries expire after `ttl` seconds (None keeps them forever) and the least
+# recently used ones are evicted once the file holds more than `max_bytes`.
+class SQLiteCache:
+    def __init__(self, path, ttl=None, max_bytes=None):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value BLOB, size INTEGER, created REAL, used REAL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.db.commit()
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    # Return {key: text} for the keys that are cached and still fresh
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        now = time.time()
+        with self.lock:
+            for chunk in _chunks(keys):
+                rows = self.db.execute(
+                    f"SELECT key, value, size, created FROM entries WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for key, value, size, created in rows:
+                    if self._expired(created, now):
+                        self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                        self.total_bytes -= size
+                    else:
+                        found[key] = zlib.decompress(value).decode("utf-8")
+            self.db.executemany(
+                "UPDATE entries SET used = ? WHERE key = ?", [(now, key) for key in found]
+            )
+            self.db.commit()
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    # Store {key: text}, then evict least recently used entries if over budget
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        for key, text in items.items():
+            value = zlib.compress(text.encode("utf-8"))
+            rows.append((key, value, len(value), now, now))
+        if not rows:
+            return
+        with self.lock:
+            replaced = 0
+            for chunk in _chunks([row[0] for row in rows]):
+                replaced += self.db.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM entries WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchone()[0]
+            self.db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", rows)
+            self.total_bytes += sum(row[2] for row in rows) - replaced
+            self._evict()
+            self.db.commit()
+
+    def put(self, key, text):
+        self.put_many({key: text})
+
+    # Drop least recently used entries until the cache is back under 90% of max_bytes
+    def _evict(self):
+        if self.max_bytes is None or self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = self.db.execute("SELECT key, size FROM entries ORDER BY used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+    def stats(self):
+        with self.lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return {"entries": entries, "bytes": self.total_bytes, "hits": self.hits, "misses": self.misses}
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+# Abstracts keyed by PMID and retrieval format (rettype/retmode)
+class AbstractCache(SQLiteCache):
+    def __init__(self, path=abstract_cache_path, ttl=abstract_cache_ttl, max_bytes=abstract_cache_max_bytes):
+        super().__init__(path, ttl, max_bytes)
+
+    @staticmethod
+    def _key(pmid, fmt):
+        return f"{fmt}:{pmid}"
+
+    # Return {pmid: text} for the PMIDs that are cached in this format
+    def get_abstracts(self, pmids, fmt="abstract/text"):
+        found = self.get_many(self._key(pmid, fmt) for pmid in pmids)
+        return {pmid: found[self._key(pmid, fmt)] for pmid in pmids if self._key(pmid, fmt) in found}
+
+    # Store {pmid: text}, skipping failed (empty) fetches
+    def put_abstracts(self, abstracts, fmt="abstract/text"):
+        self.put_many({self._key(pmid, fmt): text for pmid, text in abstracts.items() if text})
+
+
+# LLM completions keyed by a hash of everything that determines them: the
+# model id and the full request (prompt template with the abstract filled in).
+# The stored value is the raw API response, including its usage block.
+class LLMCache(SQLiteCache):
+    def __init__(self, path=llm_cache_path, ttl=llm_cache_ttl, max_bytes=llm_cache_max_bytes):
+        super().__init__(path, ttl, max_bytes)
+
+    @staticmethod
+    def key_for(payload):
+        request = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    # The cached API response for this request payload, or None
+    def get_completion(self, payload):
+        value = self.get(self.key_for(payload))
+        return json.loads(value) if value is not None else None
+
+    def put_completion(self, payload, response_data):
+        self.put(self.key_for(payload), json.dumps(response_data))
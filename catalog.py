@@ -0,0 +1,236 @@
+import json
+import os
+import threading
+import time
+
+import retry
+import transport
+
+models_url = "https://openrouter.ai/api/v1/models"
+
+# Local copy of the model catalog and how long it is trusted before it is revalidated
+catalog_path = "available_models.json"
+catalog_ttl = 24 * 3600
+
+
+def _etag_path(path):
+    return path + ".etag"
+
+
+def _read(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+# Replace the local catalog in one step, so readers never see half a file
+def _write(path, models, etag):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as json_file:
+        json.dump(models, json_file, indent=4)
+    os.replace(temp_path, path)
+    if etag:
+        with open(_etag_path(path), "w") as etag_file:
+            etag_file.write(etag)
+
+
+# Fetch the catalog, conditionally when a local copy exists. Returns the new
+# catalog, or None if the local copy is still current (or the fetch failed).
+def refresh_catalog(path=catalog_path):
+    headers = {}
+    if os.path.exists(path):
+        if os.path.exists(_etag_path(path)):
+            with open(_etag_path(path)) as etag_file:
+                headers["If-None-Match"] = etag_file.read().strip()
+        modified = time.gmtime(os.path.getmtime(path))
+        headers["If-Modified-Since"] = time.strftime("%a, %d %b %Y %H:%M:%S GMT", modified)
+
+    try:
+        response = retry.http_policy.call(lambda: transport.get(models_url, headers=headers), "model catalog")
+    except Exception as e:
+        print(f"Failed to fetch available models: {e}")
+        return None
+    if response.status_code == 304:
+        # Still current: restart the TTL
+        os.utime(path)
+        return None
+    if response.status_code != 200:
+        print(f"Failed to fetch available models: {response.status_code}, {response.text}")
+        return None
+
+    models = response.json()
+    _write(path, models, response.headers.get("ETag"))
+    print(f"Models have been exported to '{path}'")
+    return models
+
+
+# Load the model catalog. A local copy is used straight away; once it is older
+# than `ttl` it is revalidated in a background thread, and `on_update` is called
+# with the new catalog if it changed. Without a local copy the catalog is
+# fetched before returning. Returns None only if there is no catalog at all.
+def load_catalog(path=catalog_path, ttl=catalog_ttl, on_update=None):
+    models = _read(path)
+    if models is None:
+        return refresh_catalog(path)
+
+    if time.time() - os.path.getmtime(path) > ttl:
+        def revalidate():
+            updated = refresh_catalog(path)
+            if updated and on_update:
+                on_update(updated)
+
+        threading.Thread(target=revalidate, name="catalog-refresh", daemon=True).start()
+    return models
+
+
+# One catalog entry flattened into the fields models can be queried by
+def _describe(model):
+    pricing = model.get("pricing") or {}
+    provider = model.get("top_provider") or {}
+    contexts = [n for n in (model.get("context_length"), provider.get("context_length")) if n]
+    prompt_price = float(pricing.get("prompt") or 0)
+    completion_price = float(pricing.get("completion") or 0)
+    return {
+        "id": model["id"],
+        "name": model.get("name", model["id"]),
+        "provider": model["id"].split("/", 1)[0],
+        "modality": (model.get("architecture") or {}).get("modality", ""),
+        "tokenizer": (model.get("architecture") or {}).get("tokenizer", ""),
+        "context": min(contexts) if contexts else 0,
+        "prompt_price": prompt_price,
+        "completion_price": completion_price,
+        "price": prompt_price + completion_price,
+        "created": model.get("created", 0),
+    }
+
+
+# Fields models can be filtered and sorted on
+model_fields = (
+    "id",
+    "name",
+    "provider",
+    "modality",
+    "tokenizer",
+    "context",
+    "prompt_price",
+    "completion_price",
+    "price",
+    "created",
+)
+
+# Comparison operators of the filter syntax, longest first so ">=" wins over ">"
+_operators = {
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+    "!=": lambda a, b: a != b,
+    "~": lambda a, b: str(b).lower() in str(a).lower(),
+    "=": lambda a, b: a == b,
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+}
+
+# Shorthand words of the filter syntax: a condition, or an order to sort by
+_keywords = {
+    "text": ("modality", "=", "text->text"),
+    "vision": ("modality", "~", "image"),
+    "free": ("price", "=", 0.0),
+}
+_orders = {
+    "cheapest": ("price", False),
+    "largest": ("context", True),
+    "newest": ("created", True),
+}
+
+
+def _parse_value(field, value):
+    if field in ("context", "created"):
+        multiplier = {"k": 1000, "m": 1000000}.get(value[-1:].lower(), 1)
+        return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+    if field in ("prompt_price", "completion_price", "price"):
+        return float(value)
+    return value
+
+
+# Index over the model catalog (available_models.json), by id, provider and
+# modality, that models can be queried and selected from without a prompt
+class ModelIndex:
+    def __init__(self, models):
+        self.entries = []
+        self.by_id = {}
+        self.by_provider = {}
+        self.by_modality = {}
+        for model in models.get("data", []):
+            entry = _describe(model)
+            self.entries.append(entry)
+            self.by_id[entry["id"]] = entry
+            self.by_provider.setdefault(entry["provider"], []).append(entry)
+            self.by_modality.setdefault(entry["modality"], []).append(entry)
+
+    def get(self, model_id):
+        return self.by_id.get(model_id)
+
+    # Models matching every condition, e.g. query(provider="openai", min_context=32000),
+    # ordered by `sort` (a field name; descending=True for largest first)
+    def query(
+        self,
+        provider=None,
+        modality=None,
+        min_context=None,
+        max_prompt_price=None,
+        max_completion_price=None,
+        conditions=(),
+        sort="price",
+        descending=False,
+    ):
+        if provider is not None:
+            entries = self.by_provider.get(provider, [])
+        elif modality is not None:
+            entries = self.by_modality.get(modality, [])
+        else:
+            entries = self.entries
+        conditions = list(conditions)
+        if modality is not None:
+            conditions.append(("modality", "=", modality))
+        if min_context is not None:
+            conditions.append(("context", ">=", min_context))
+        if max_prompt_price is not None:
+            conditions.append(("prompt_price", "<=", max_prompt_price))
+        if max_completion_price is not None:
+            conditions.append(("completion_price", "<=", max_completion_price))
+        # Negative prices mark routers whose cost is only known per request
+        matches = [
+            entry
+            for entry in entries
+            if entry["price"] >= 0 and all(_operators[op](entry[field], value) for field, op, value in conditions)
+        ]
+        return sorted(matches, key=lambda entry: entry[sort], reverse=descending)
+
+    # Pick a model by exact id, or by a filter made of space or comma separated
+    # terms: conditions such as "context>=32k", "provider=openai",
+    # "prompt_price<=0.000001" or "id~llama", the words "text", "vision" and
+    # "free", and an order, "cheapest" (the default), "largest" or "newest".
+    # "cheapest text context>=32k" is the cheapest text model with a 32k context.
+    def select(self, spec):
+        if spec in self.by_id:
+            return spec
+        conditions = []
+        sort, descending = _orders["cheapest"]
+        for term in spec.replace(",", " ").split():
+            if term in _orders:
+                sort, descending = _orders[term]
+            elif term in _keywords:
+                conditions.append(_keywords[term])
+            else:
+                for op in _operators:
+                    field, found, value = term.partition(op)
+                    if found:
+                        break
+                else:
+                    raise ValueError(f"Cannot understand model filter term {term!r}")
+                if field not in model_fields:
+                    raise ValueError(f"Unknown model field {field!r} in {term!r}")
+                conditions.append((field, op, _parse_value(field, value)))
+        matches = self.query(conditions=conditions, sort=sort, descending=descending)
+        return matches[0]["id"] if matches else None
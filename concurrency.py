@@ -0,0 +1,110 @@
+import threading
+import time
+
+# Starting and allowed range of in-flight LLM requests, for each model and
+# for each provider
+initial_limit = 4
+min_limit = 1
+max_limit = 32
+
+# Additive increase: the limit grows by `increase` once a full window of
+# requests (as many as the limit) has succeeded at a healthy latency.
+# Multiplicative decrease: it is multiplied by `decrease` on congestion.
+increase = 1.0
+decrease = 0.5
+
+# A request is healthy if it took at most this many times the fastest
+# (smoothed) latency seen for its model or provider
+latency_tolerance = 3.0
+
+# Status codes that mean the API is overloaded
+congestion_statuses = {429, 503}
+
+
+# Window of one key (a model or a provider)
+class _Limit:
+    def __init__(self, limit):
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency = None
+        self.best_latency = None
+        self.peak = int(limit)
+        self.cuts = 0
+        self.cut_at = 0.0
+
+
+# AIMD controller for the number of LLM requests in flight. Every request
+# holds a slot of its model and one of its provider (the part of the model id
+# before "/"), so a busy provider slows down all of its models. Limits grow
+# additively while requests succeed at a healthy latency, and are halved on
+# 429/503, timeouts and Retry-After, which also pause new requests for the
+# time the API asked for. Requests that were already in flight when the limit
+# was cut do not cut it again, so one burst of 429s halves it only once.
+# Blocking: meant to be called from worker threads.
+class AdaptiveLimiter:
+    def __init__(self, initial=initial_limit, minimum=min_limit, maximum=max_limit):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.condition = threading.Condition()
+        self.limits = {}
+
+    @staticmethod
+    def _keys(model):
+        return (model, model.split("/", 1)[0] + "/*")
+
+    def _limit(self, key):
+        if key not in self.limits:
+            self.limits[key] = _Limit(self.initial)
+        return self.limits[key]
+
+    # Wait for a free slot of the model and of its provider, and take both.
+    # Returns the time the request started, to be passed to release().
+    def acquire(self, model):
+        with self.condition:
+            limits = [self._limit(key) for key in self._keys(model)]
+            while True:
+                now = time.monotonic()
+                paused_until = max(limit.paused_until for limit in limits)
+                if paused_until <= now and all(limit.in_flight < int(limit.limit) for limit in limits):
+                    break
+                self.condition.wait(paused_until - now if paused_until > now else None)
+            for limit in limits:
+                limit.in_flight += 1
+        return time.monotonic()
+
+    # Give the slots back. success marks a usable response, congested a
+    # 429/503 or timeout, retry_after the seconds the API asked to wait.
+    def release(self, model, started, success=False, congested=False, retry_after=None):
+        now = time.monotonic()
+        latency = now - started
+        with self.condition:
+            for key in self._keys(model):
+                limit = self._limit(key)
+                limit.in_flight -= 1
+                if congested or retry_after:
+                    if started >= limit.cut_at:
+                        limit.limit = max(self.minimum, limit.limit * decrease)
+                        limit.cuts += 1
+                        limit.cut_at = now
+                    if retry_after:
+                        limit.paused_until = max(limit.paused_until, now + retry_after)
+                elif success:
+                    limit.latency = latency if limit.latency is None else 0.8 * limit.latency + 0.2 * latency
+                    limit.best_latency = min(limit.best_latency or limit.latency, limit.latency)
+                    if latency <= latency_tolerance * limit.best_latency:
+                        limit.limit = min(self.maximum, limit.limit + increase / limit.limit)
+                        limit.peak = max(limit.peak, int(limit.limit))
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return {
+                key: {"limit": int(limit.limit), "peak": limit.peak, "cuts": limit.cuts}
+                for key, limit in self.limits.items()
+            }
+
+
+# Shared by every LLM request of the run
+llm_limiter = AdaptiveLimiter()
@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+# A request is hedged once it has taken longer than this percentile of its
+# model's latency, or default_delay seconds until enough latencies are known
+percentile = 0.95
+min_samples = 20
+default_delay = 30.0
+
+# At most this fraction of requests is hedged, and hedges stop once their
+# price (counted in full, even for the ones cancelled) reaches max_extra_cost
+# dollars; None means no limit
+max_hedge_rate = 0.1
+max_extra_cost = None
+
+# Threads the hedged requests run on
+hedge_workers = 64
+
+
+# Raised by a request whose hedge answered first
+class Cancelled(Exception):
+    pass
+
+
+# Sends a request and, if it has not been answered after a delay, a copy of
+# it to a second model; the first usable answer wins and the other request
+# is cancelled. Both requests are callables taking a threading.Event that
+# is set when their answer is no longer needed; they return a result, or
+# None if they failed.
+class Hedger:
+    def __init__(self, max_rate=max_hedge_rate, max_cost=max_extra_cost, workers=hedge_workers):
+        self.max_rate = max_rate
+        self.max_cost = max_cost
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.extra_cost = 0.0
+
+    # Whether one more hedge, costing `cost` dollars, stays within the caps
+    def _allow(self, cost):
+        with self.lock:
+            if self.hedges + 1 > self.max_rate * self.requests:
+                return False
+            if self.max_cost is not None and self.extra_cost + cost > self.max_cost:
+                return False
+            self.hedges += 1
+            self.extra_cost += cost
+            return True
+
+    def run(self, primary, secondary, delay, cost=0.0):
+        with self.lock:
+            self.requests += 1
+        cancels = [threading.Event(), threading.Event()]
+        first = self.executor.submit(primary, cancels[0])
+        try:
+            return first.result(timeout=delay)
+        except TimeoutError:
+            pass
+        if not self._allow(cost):
+            return first.result()
+
+        print(f"No answer after {delay:.1f}s, hedging the request")
+        second = self.executor.submit(secondary, cancels[1])
+        pending = {first: cancels[1], second: cancels[0]}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                other_cancel = pending.pop(future)
+                result = future.result()
+                if result is not None:
+                    other_cancel.set()
+                    if future is second:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    return result
+        return None
+
+    def report(self):
+        with self.lock:
+            rate = self.hedges / self.requests if self.requests else 0.0
+            print(
+                f"Hedged {self.hedges} of {self.requests} LLM requests ({rate:.1%}), "
+                f"the hedge answered first {self.hedge_wins} times, "
+                f"extra cost at most ${self.extra_cost:.4f}"
+            )
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import time
+
+# Default location of the progress journal
+journal_path = "run_journal.jsonl"
+
+
+# Append-only JSONL record of a run. The first line describes the run
+# (keyword, model, ...); every later line records one PMID finishing a stage,
+# with the extracted trial attached once the LLM stage is done. Lines are
+# flushed as they are written, so a crash of the run loses at most the trials
+# that were in flight; fsync is batched to every `fsync_every` lines or
+# `fsync_interval` seconds, as in writers.CSVWriter. With resume=True an
+# existing journal is read back and extended instead of being replaced; only
+# the stages and results read back are kept in memory, so a run's memory
+# does not grow with the number of trials it records.
+class Journal:
+    def __init__(self, path=journal_path, resume=False, fsync_every=50, fsync_interval=5.0):
+        self.path = path
+        self.run = {}
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.results = {}
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+        if resume and os.path.exists(path):
+            complete = self._load()
+            self.file = open(path, "a", encoding="utf-8")
+            if not complete:
+                # Start after the torn line rather than on the end of it
+                self.file.write("\n")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    # Describe the run on the first line (kept as is when resuming)
+    def start(self, run):
+        if not self.run:
+            self._write({"run": run})
+        self.run = run
+
+    # Read an existing journal back, ignoring a line cut short by a crash.
+    # Returns False if the file does not end with a complete line.
+    def _load(self):
+        line = "\n"
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "run" in entry:
+                    self.run = entry["run"]
+                    continue
+                self.stages[entry["id"]] = entry["stage"]
+                if entry["stage"] == "extracted":
+                    self.results[entry["id"]] = entry["result"]
+        return line.endswith("\n")
+
+    def _write(self, entry):
+        with self.lock:
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every or time.monotonic() - self.synced_at >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    # Record that a trial finished a stage ("fetched", "extracted", "partial"
+    # or "failed"); only "extracted" trials are skipped when resuming
+    def record(self, trial_id, stage, result=None):
+        entry = {"id": trial_id, "stage": stage}
+        if result is not None:
+            entry["result"] = result
+        self._write(entry)
+
+    # The extracted trial from the run being resumed, or None if it still has
+    # to be done
+    def result(self, trial_id):
+        with self.lock:
+            return self.results.get(trial_id)
+
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            self._sync()
+            self.file.close()
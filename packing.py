@@ -0,0 +1,96 @@
+# Rough characters per token for the tokenizer families in the model catalog.
+# They err on the low side, so token estimates err on the high side.
+chars_per_token = {
+    "GPT": 3.8,
+    "Claude": 3.4,
+    "Llama3": 3.8,
+    "Gemini": 3.8,
+    "Qwen": 3.4,
+    "Cohere": 3.6,
+    "Grok": 3.6,
+}
+default_chars_per_token = 3.0
+
+# Context assumed for models the catalog does not describe
+default_context_length = 8192
+
+# Completion tokens to reserve for the answers of one trial (35 short answers)
+answer_tokens_per_trial = 1500
+
+# Fraction of the context window actually planned for, to absorb estimate errors
+context_safety = 0.85
+
+# Upper bound on abstracts per request, whatever the context allows
+max_batch_size = 20
+
+# Marker left at the end of a truncated abstract
+truncation_marker = "\n[Abstract truncated to fit the model's context window]\n"
+
+
+def estimate_tokens(text, tokenizer=None):
+    return int(len(text) / chars_per_token.get(tokenizer, default_chars_per_token)) + 1
+
+
+# Token limits of one model, taken from its catalog entry (see available_models.json)
+class TokenBudget:
+    def __init__(self, model=None):
+        model = model or {}
+        provider = model.get("top_provider") or {}
+        limits = [n for n in (model.get("context_length"), provider.get("context_length")) if n]
+        self.context_length = min(limits) if limits else default_context_length
+        self.max_completion_tokens = provider.get("max_completion_tokens")
+        self.tokenizer = (model.get("architecture") or {}).get("tokenizer")
+
+    def tokens(self, text):
+        return estimate_tokens(text, self.tokenizer)
+
+    # Completion tokens needed for the answers of `trials` trials
+    def completion_tokens(self, trials):
+        return trials * answer_tokens_per_trial
+
+    # Prompt tokens left once `fixed_tokens` of instructions are sent and the
+    # answers of `trials` trials are reserved; negative if that does not fit
+    def prompt_room(self, fixed_tokens, trials=1):
+        return int(self.context_length * context_safety) - fixed_tokens - self.completion_tokens(trials)
+
+    # Most trials whose answers fit the model's completion limit
+    def max_trials(self):
+        if not self.max_completion_tokens:
+            return max_batch_size
+        return max(1, min(max_batch_size, self.max_completion_tokens // answer_tokens_per_trial))
+
+    # Cut text down to at most max_tokens (estimated), keeping its start
+    def truncate(self, text, max_tokens):
+        if self.tokens(text) <= max_tokens:
+            return text
+        ratio = chars_per_token.get(self.tokenizer, default_chars_per_token)
+        keep = max(0, int((max_tokens - self.tokens(truncation_marker)) * ratio))
+        return text[:keep] + truncation_marker
+
+
+# Split [(trial_id, text)] into batches that fit the model: each batch's
+# prompt plus the answers reserved for its trials stays inside the context
+# window, and its answers inside the completion limit. An abstract too long
+# to fit even on its own is truncated. fixed_tokens covers the instructions,
+# item_overhead the delimiter sent with every abstract.
+def pack(items, budget, fixed_tokens, limit=None, item_overhead=16):
+    limit = min(limit or max_batch_size, budget.max_trials())
+    batches = []
+    batch = []
+    used = 0
+    for trial_id, text in items:
+        tokens = budget.tokens(text) + item_overhead
+        if batch and (len(batch) >= limit or used + tokens > budget.prompt_room(fixed_tokens, len(batch) + 1)):
+            batches.append(batch)
+            batch = []
+            used = 0
+        room = budget.prompt_room(fixed_tokens, 1) - item_overhead
+        if tokens - item_overhead > room:
+            print(f"Abstract for trial ID {trial_id} is too long for the model, truncating it")
+            text = budget.truncate(text, room)
+            tokens = budget.tokens(text) + item_overhead
+        batch.append((trial_id, text))
+        used += tokens
+    if batch:
+        batches.append(batch)
+    return batches
@@ -0,0 +1,242 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import ai
+import breaker
+import concurrency
+import packing
+import ratelimit
+import transport
+
+# Default concurrency limits for each stage of the pipeline. LLM workers are
+# only an upper bound: concurrency.llm_limiter adapts the number of requests
+# actually in flight to what the API sustains.
+fetch_concurrency = 4
+llm_concurrency = concurrency.max_limit
+
+# Most abstracts sent together in one LLM request: 1 sends each on its own,
+# 0 packs as many as the model's context window allows
+llm_batch_size = 1
+
+# Maximum number of items waiting between two stages
+queue_size = 100
+
+# Marks the end of a queue
+_DONE = object()
+
+
+# Run a blocking function (requests based) on the pipeline's thread pool
+async def _run_blocking(executor, func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, func, *args)
+
+
+# Start a stage made of `workers` copies of `worker`, all reading from in_queue.
+# Once they have all drained it, the end marker is passed on to out_queue.
+# With a batch_size, each worker is handed a list of up to that many items:
+# whatever is already waiting in the queue, without holding out for more.
+async def _run_stage(worker, workers, in_queue, out_queue, batch_size=None):
+    async def loop():
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                # Let the sibling workers see the marker too
+                await in_queue.put(_DONE)
+                return
+            if batch_size is None:
+                await worker(item)
+                continue
+            batch = [item]
+            while len(batch) < batch_size and not in_queue.empty():
+                item = in_queue.get_nowait()
+                if item is _DONE:
+                    await in_queue.put(_DONE)
+                    break
+                batch.append(item)
+            await worker(batch)
+
+    await asyncio.gather(*(loop() for _ in range(workers)))
+    await out_queue.put(_DONE)
+
+
+# Search stage: split the search into date windows small enough for ESearch
+# to page through, start one history server session per window in parallel,
+# and hand their result ranges on to the fetch stage. Sequence numbers run
+# across the windows, so the writer can restore the search order. Only as
+# many windows are looked for as `limit` needs; count is the search's result
+# count, if already known.
+async def _search_stage(executor, keyword, limit, out_queue, count=None):
+    windows = await _run_blocking(executor, ai.partition_search, keyword, None, None, count, limit)
+    sessions = []
+    planned = 0
+    for mindate, maxdate, count in windows:
+        if planned >= limit:
+            break
+        sessions.append(ai.SearchSession(keyword, mindate=mindate, maxdate=maxdate))
+        planned += min(count, ai.esearch_max_results)
+    await asyncio.gather(*(_run_blocking(executor, session.start) for session in sessions))
+
+    batches = []
+    offset = 0
+    for session in sessions:
+        session_ranges = session.batch_ranges(limit - offset)
+        batches += [(session, offset + retstart, retstart, retmax) for retstart, retmax in session_ranges]
+        offset += sum(retmax for _, retmax in session_ranges)
+    print(f"Planned {offset} results from {len(sessions)} date windows in {len(batches)} batches")
+    for batch in batches:
+        await out_queue.put(batch)
+    await out_queue.put(_DONE)
+
+
+# Run the search -> abstract fetch -> LLM extraction -> writer pipeline.
+# Returns the extracted trials in the same order as the sequential loop.
+# With a journal, every trial's progress is recorded as soon as it happens
+# and trials the journal already holds a result for skip the LLM stage.
+# With a writer, trials are written out as they complete instead of being
+# collected, so the returned list is empty. With a model router, each request
+# goes to the best model it offers instead of selected_model, and with a
+# hedger single-abstract requests are also hedged (see hedge.py). With
+# refresh_cache, completions are requested again even if the LLM cache
+# holds them (the new ones replace them in the cache). result_count, the
+# number of results the keyword has if already counted, saves counting again.
+async def run_pipeline(
+    keyword,
+    limit,
+    selected_model,
+    fetch_workers=fetch_concurrency,
+    llm_workers=llm_concurrency,
+    llm_batch=llm_batch_size,
+    max_queue=queue_size,
+    journal=None,
+    writer=None,
+    model_router=None,
+    hedger=None,
+    refresh_cache=False,
+    result_count=None,
+):
+    range_queue = asyncio.Queue(max_queue)
+    info_queue = asyncio.Queue(max_queue)
+    result_queue = asyncio.Queue(max_queue)
+    executor = ThreadPoolExecutor(max_workers=1 + fetch_workers + llm_workers)
+    # Every worker should be able to hold a keep-alive connection to its host
+    if max(fetch_workers, llm_workers) > transport.pool_size:
+        transport.configure(pool=max(fetch_workers, llm_workers))
+
+    # Abstract fetch stage: one history server EFetch per result range
+    async def fetch(batch_range):
+        session, seq, retstart, retmax = batch_range
+        records = await _run_blocking(executor, session.fetch_batch, retstart, retmax)
+        trial_ids = [trial_id for trial_id, _ in records]
+        print(f"Parsed trial IDs for results {seq + 1}-{seq + retmax}: {trial_ids}")
+        for offset in range(retmax):
+            trial_id, trial_info = records[offset] if offset < len(records) else (None, None)
+            done = journal.result(trial_id) if journal and trial_id else None
+            if done:
+                print(f"\nTrial ID {trial_id} was already extracted, skipping")
+                await result_queue.put((seq + offset, trial_id, done))
+            elif trial_info:
+                if journal:
+                    journal.record(trial_id, "fetched")
+                print(f"\nFetched trial info for ID {trial_id}:")
+                print(trial_info)
+                await info_queue.put((seq + offset, trial_id, trial_info))
+            else:
+                if journal and trial_id:
+                    journal.record(trial_id, "failed")
+                # Keep the sequence dense so the writer never waits on a gap
+                await result_queue.put((seq + offset, trial_id, None))
+
+    # LLM extraction stage: up to llm_batch abstracts per request, split
+    # further where the model's context window calls for it
+    batch_limit = llm_batch or packing.max_batch_size
+
+    async def extract(batch):
+        if len(batch) == 1:
+            seq, trial_id, trial_info = batch[0]
+            if hedger:
+                structured_data = await _run_blocking(
+                    executor, ai.hedged_llm_call, trial_info, model_router, hedger, refresh_cache
+                )
+            elif model_router:
+                structured_data = await _run_blocking(
+                    executor, ai.route_llm_call, trial_info, model_router, refresh_cache
+                )
+            else:
+                structured_data = await _run_blocking(
+                    executor, ai.call_llm_api, trial_info, selected_model, refresh_cache
+                )
+            results = {trial_id: structured_data}
+        else:
+            items = [(trial_id, trial_info) for _, trial_id, trial_info in batch]
+            if model_router:
+                # Batches fail over between models like single requests
+                results = await _run_blocking(
+                    executor, ai.route_llm_batch, items, model_router, batch_limit, refresh_cache
+                )
+            else:
+                results = {}
+                for packed in ai.pack_abstracts(items, selected_model, batch_limit):
+                    results.update(
+                        await _run_blocking(executor, ai.call_llm_api_batch, packed, selected_model, refresh_cache)
+                    )
+        for seq, trial_id, _ in batch:
+            structured_data = results.get(trial_id)
+            if journal:
+                # A partial record (the stream dropped) is kept but done again on resume
+                stage = "failed" if not structured_data else (
+                    "partial" if isinstance(structured_data, ai.PartialRecord) else "extracted"
+                )
+                journal.record(trial_id, stage, structured_data)
+            await result_queue.put((seq, trial_id, structured_data))
+
+    # Writer stage: put results back into sequence order, skipping failures
+    all_trials = []
+
+    async def write():
+        pending = {}
+        next_seq = 0
+        while True:
+            item = await result_queue.get()
+            if item is _DONE:
+                break
+            pending[item[0]] = item
+            while next_seq in pending:
+                _, trial_id, structured_data = pending.pop(next_seq)
+                next_seq += 1
+                if not structured_data:
+                    continue
+                print(f"Structured data for trial ID {trial_id}: {structured_data}")
+                # The PMID identifies the trial across runs (merge mode keys on it)
+                record = {**structured_data, "PMID": trial_id}
+                if writer:
+                    writer.write(record)
+                else:
+                    all_trials.append(record)
+
+    # Failed fetches go straight to the writer; they are all queued before the
+    # LLM stage sees its end marker, so its marker also closes the writer.
+    try:
+        await asyncio.gather(
+            _search_stage(executor, keyword, limit, range_queue, result_count),
+            _run_stage(fetch, fetch_workers, range_queue, info_queue),
+            _run_stage(extract, llm_workers, info_queue, result_queue, batch_size=batch_limit),
+            write(),
+        )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    stats = ratelimit.ncbi_limiter.stats()
+    print(
+        f"NCBI requests: {stats['calls']}, waited {stats['waited']:.1f}s in total "
+        f"(longest {stats['max_wait']:.2f}s) for the rate limit"
+    )
+    for key, limit in concurrency.llm_limiter.stats().items():
+        print(f"LLM concurrency for {key}: {limit['limit']} (peak {limit['peak']}, cut {limit['cuts']} times)")
+    for name, state in breaker.llm_breakers.stats().items():
+        print(f"Circuit breaker for {name} opened {state['opens']} times, now {state['state']}")
+    if model_router:
+        model_router.report()
+    if hedger:
+        hedger.report()
+    return all_trials
+
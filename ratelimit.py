@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+# Requests per second NCBI E-utilities allow without and with an API key
+ncbi_rate_unkeyed = 3
+ncbi_rate_keyed = 10
+
+
+# Token bucket shared by threads and asyncio tasks. Each call reserves a token
+# straight away (the balance may go negative) and then waits until that token
+# is due, so callers are served in arrival order at no more than `rate` per second.
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    # Change the rate, e.g. once an API key is known
+    def set_rate(self, rate, capacity=None):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+            if capacity is not None:
+                self.capacity = capacity
+                self.tokens = min(self.tokens, capacity)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Take a token and return how long the caller has to wait for it
+    def _reserve(self):
+        with self.lock:
+            self._refill()
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate)
+            self.calls += 1
+            self.waited += wait
+            self.max_wait = max(self.max_wait, wait)
+            return wait
+
+    # Block the current thread until a request may be sent; returns the wait
+    def acquire(self):
+        wait = self._reserve()
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    # Same as acquire, for asyncio tasks
+    async def acquire_async(self):
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        return wait
+
+    # How much the limiter has throttled its callers so far
+    def stats(self):
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "waited": self.waited,
+                "max_wait": self.max_wait,
+                "average_wait": self.waited / self.calls if self.calls else 0.0,
+            }
+
+
+# Process-wide limiter every E-utilities request goes through
+ncbi_limiter = TokenBucket(ncbi_rate_unkeyed)
+
+
+# Set the NCBI limit for keyed or unkeyed use (or an explicit rate)
+def configure_ncbi_limiter(api_key=None, rate=None):
+    ncbi_limiter.set_rate(rate or (ncbi_rate_keyed if api_key else ncbi_rate_unkeyed))
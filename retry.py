@@ -0,0 +1,110 @@
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+import transport
+
+# Status codes worth asking again for: the server was overloaded, timed out
+# or failed in a way that says nothing about the request itself
+retry_statuses = {408, 425, 429, 500, 502, 503, 504}
+
+# Status codes that promise the request was not processed, so even a
+# request that is not idempotent (an LLM completion) can be sent again
+safe_statuses = {429, 503}
+
+
+# Parse a Retry-After header (seconds, or an HTTP date) into seconds, or None
+def retry_after_seconds(headers):
+    value = (headers or {}).get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Whether a requests ConnectionError is a failure to open the connection
+# (refused, unreachable, DNS), as opposed to one dropped after the request
+# was sent, which requests raises as the same type
+def failed_to_connect(error):
+    if not isinstance(error, requests.exceptions.ConnectionError) or not error.args:
+        return False
+    reason = error.args[0]
+    return isinstance(reason, MaxRetryError) and isinstance(reason.reason, NewConnectionError)
+
+
+# When and how often a request is sent again: up to `attempts` tries,
+# `deadline` seconds at most in all, waiting between tries for a random time
+# up to base * 2**n seconds (full jitter, capped at `cap`) or as long as
+# Retry-After asks, whichever is longer. Idempotent requests are retried on
+# retry_statuses and on any connection error or timeout; others only on
+# safe_statuses and on failures to connect, where nothing was sent.
+class RetryPolicy:
+    def __init__(self, attempts=4, base=0.5, cap=30.0, deadline=120.0, idempotent=True):
+        self.attempts = attempts
+        self.base = base
+        self.cap = cap
+        self.deadline = deadline
+        self.idempotent = idempotent
+
+    def _retryable_status(self, status):
+        return status in (retry_statuses if self.idempotent else safe_statuses)
+
+    def _retryable_error(self, error):
+        if self.idempotent:
+            return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+        return isinstance(error, (requests.exceptions.ConnectTimeout, transport.ConnectFailed)) or (
+            failed_to_connect(error)
+        )
+
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.cap, self.base * 2**attempt))
+        return max(delay, retry_after or 0)
+
+    # Call send() until it returns a response that should not be retried.
+    # Returns the last response, or raises the last error once the attempts
+    # or the deadline run out.
+    def call(self, send, description="request", attempts=None):
+        attempts = attempts or self.attempts
+        give_up_at = time.monotonic() + self.deadline if self.deadline else None
+        for attempt in range(attempts):
+            last_try = attempt == attempts - 1
+            try:
+                response = send()
+            except requests.exceptions.RequestException as error:
+                wait = self.backoff(attempt)
+                if last_try or not self._retryable_error(error) or self._past(give_up_at, wait):
+                    raise
+                reason = type(error).__name__
+            else:
+                if last_try or not self._retryable_status(response.status_code):
+                    return response
+                wait = self.backoff(attempt, retry_after_seconds(response.headers))
+                if self._past(give_up_at, wait):
+                    return response
+                reason = response.status_code
+            print(f"Retrying {description} in {wait:.1f}s ({reason}, attempt {attempt + 1}/{attempts})")
+            time.sleep(wait)
+
+    @staticmethod
+    def _past(give_up_at, wait):
+        return give_up_at is not None and time.monotonic() + wait > give_up_at
+
+
+# E-utilities requests are all GETs
+ncbi_policy = RetryPolicy(attempts=4, base=1.0, cap=30.0, deadline=120.0)
+
+# Chat completions are POSTs; a rate limited model is also worth failing over
+# from (see router.py), so they are not retried for long
+llm_policy = RetryPolicy(attempts=3, base=2.0, cap=30.0, deadline=180.0, idempotent=False)
+
+# Other GETs, such as the model catalog
+http_policy = RetryPolicy(attempts=3, base=1.0, cap=10.0, deadline=60.0)
@@ -0,0 +1,109 @@
+import threading
+from collections import deque
+
+import breaker
+
+# Latency assumed for a model until a request to it has been timed, in seconds
+default_latency = 20.0
+
+# What a second of waiting is worth next to the price of a request, in dollars
+latency_cost = 0.0001
+
+# Weight of the newest observation in the latency and success rate averages
+smoothing = 0.2
+
+# Latencies kept per model for percentiles (see hedge.py)
+latency_samples = 200
+
+# Status codes that send a request on to the next model: rate limits,
+# timeouts and server errors. Other 4xx errors are the request's fault.
+failover_statuses = {408, 429, 500, 502, 503, 504}
+
+
+def should_fail_over(status):
+    return status is None or status in failover_statuses
+
+
+# What the router has observed of one model
+class ModelStats:
+    def __init__(self):
+        self.latency = None
+        self.samples = deque(maxlen=latency_samples)
+        self.success_rate = 1.0
+        self.requests = 0
+        self.errors = 0
+
+
+# Ranks candidate models for each request by the expected cost of a
+# successful answer: the request's price from the model catalog, plus its
+# observed latency (priced at `latency_cost` per second), divided by the
+# model's recent success rate. Models whose circuit breaker is open (see
+# breaker.py) go last.
+class ModelRouter:
+    def __init__(self, models, index):
+        self.models = list(dict.fromkeys(models))
+        self.index = index
+        self.stats = {model: ModelStats() for model in self.models}
+        self.lock = threading.Lock()
+
+    # Price in dollars of a request to `model` of this size
+    def price(self, model, prompt_tokens, completion_tokens):
+        entry = self.index.get(model) or {}
+        prompt_price = max(entry.get("prompt_price", 0.0), 0.0)
+        completion_price = max(entry.get("completion_price", 0.0), 0.0)
+        return prompt_tokens * prompt_price + completion_tokens * completion_price
+
+    def score(self, model, prompt_tokens, completion_tokens):
+        stats = self.stats[model]
+        latency = stats.latency if stats.latency is not None else default_latency
+        cost = self.price(model, prompt_tokens, completion_tokens) + latency * latency_cost
+        return cost / max(stats.success_rate, 0.05)
+
+    # Candidate models for a request, best first: models whose breakers are
+    # closed by score, then the others, the one that reopens first leading
+    def rank(self, prompt_tokens, completion_tokens):
+        healthy = [model for model in self.models if breaker.llm_breakers.available(model)]
+        broken = [model for model in self.models if model not in healthy]
+        with self.lock:
+            healthy.sort(key=lambda model: self.score(model, prompt_tokens, completion_tokens))
+        broken.sort(key=breaker.llm_breakers.retry_at)
+        return healthy + broken
+
+    # Record an answer; latency is None when it came from the cache
+    def success(self, model, latency=None):
+        with self.lock:
+            stats = self.stats[model]
+            stats.requests += 1
+            if latency is not None:
+                stats.samples.append(latency)
+                stats.latency = latency if stats.latency is None else (
+                    (1 - smoothing) * stats.latency + smoothing * latency
+                )
+            stats.success_rate = (1 - smoothing) * stats.success_rate + smoothing
+
+    # Record a failed request
+    def failure(self, model):
+        with self.lock:
+            stats = self.stats[model]
+            stats.requests += 1
+            stats.errors += 1
+            stats.success_rate = (1 - smoothing) * stats.success_rate
+
+    # The q-th quantile of the model's recent latencies, or None with fewer
+    # than min_samples of them
+    def latency_percentile(self, model, q, min_samples=1):
+        with self.lock:
+            samples = sorted(self.stats[model].samples)
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def report(self):
+        with self.lock:
+            for model in self.models:
+                stats = self.stats[model]
+                latency = f"{stats.latency:.1f}s" if stats.latency is not None else "n/a"
+                print(
+                    f"{model}: {stats.requests} requests, {stats.errors} errors, "
+                    f"average latency {latency}"
+                )
@@ -0,0 +1,196 @@
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+# httpx is optional; it is only needed for HTTP/2
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Keep-alive connections kept open per host; enough for the pipeline's LLM
+# workers (concurrency.max_limit), so a run does not have to reconfigure
+pool_size = 32
+
+# Default (connect, read) timeouts in seconds
+timeout = (10, 120)
+
+# Hosts to reach over HTTP/2 (requires httpx[http2]); all others use requests
+http2_hosts = set()
+
+# One pooled session per host, shared by every thread, and the sessions
+# replaced by configure() that other threads may still be using
+_sessions = {}
+_retired = []
+_lock = threading.Lock()
+
+
+# Change the pool size, default timeouts or HTTP/2 hosts. The sessions that
+# already exist are left to the requests using them (until close()); the
+# next request to their host opens a new session with the new settings.
+def configure(pool=None, timeouts=None, http2=None):
+    global pool_size, timeout, http2_hosts
+    with _lock:
+        if pool is not None:
+            pool_size = pool
+        if timeouts is not None:
+            timeout = timeouts
+        if http2 is not None:
+            http2_hosts = set(http2)
+        _retired.extend(_sessions.values())
+        _sessions.clear()
+
+
+def _new_session(host):
+    if host in http2_hosts:
+        if httpx is not None:
+            return httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                headers={"Accept-Encoding": "gzip, deflate"},
+            )
+        print(f"httpx is not installed, using HTTP/1.1 for {host}")
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Accept-Encoding"] = "gzip, deflate"
+    return session
+
+
+# The pooled session for the host of `url`
+def session_for(url):
+    host = urlsplit(url).netloc
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = _new_session(host)
+        return session
+
+
+# Raised when a connection could not be opened at all, so the request was
+# never sent (see retry.py)
+class ConnectFailed(requests.exceptions.ConnectionError):
+    pass
+
+
+# The requests exception matching an httpx one, so callers only ever see
+# requests exceptions whichever client sent the request
+def _translate_error(error):
+    if isinstance(error, httpx.ConnectTimeout):
+        return requests.exceptions.ConnectTimeout(str(error))
+    if isinstance(error, httpx.TimeoutException):
+        return requests.exceptions.ReadTimeout(str(error))
+    if isinstance(error, httpx.ConnectError):
+        return ConnectFailed(str(error))
+    if isinstance(error, httpx.TransportError):
+        return requests.exceptions.ConnectionError(str(error))
+    return requests.exceptions.RequestException(str(error))
+
+
+# File-like body of a streamed httpx response, for requests.Response.raw.
+# read() returns as soon as some data has arrived, like a socket, so events
+# are seen as they come; a failure is raised once the data before it is read.
+class _HTTPXBody:
+    def __init__(self, response):
+        self.response = response
+        self.chunks = response.iter_bytes()
+        self.buffer = b""
+        self.error = None
+
+    def read(self, amount=None):
+        while not self.buffer or amount is None:
+            if self.error:
+                break
+            try:
+                chunk = next(self.chunks, None)
+            except httpx.HTTPError as e:
+                self.error = _translate_error(e)
+                break
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if not self.buffer and self.error:
+            raise self.error
+        if amount is None:
+            amount = len(self.buffer)
+        data, self.buffer = self.buffer[:amount], self.buffer[amount:]
+        return data
+
+    def close(self):
+        self.response.close()
+
+
+# Wrap an httpx response as a requests.Response, so raise_for_status(),
+# .ok, .text, iter_lines() and the rest behave the same for both clients
+def _as_requests_response(response, stream=False):
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.headers = CaseInsensitiveDict(response.headers)
+    converted.url = str(response.url)
+    converted.reason = response.reason_phrase
+    converted.encoding = response.charset_encoding
+    if stream:
+        converted.raw = _HTTPXBody(response)
+    else:
+        converted._content = response.content
+        response.close()
+    return converted
+
+
+# Send a request over the pooled session for its host. With stream=True the
+# body is left unread, for responses consumed as they arrive (server-sent
+# events): read it with iter_lines(), or read() it whole, and close() the
+# response to stop early. Responses and errors are always requests ones.
+def request(method, url, stream=False, **kwargs):
+    kwargs.setdefault("timeout", timeout)
+    session = session_for(url)
+    if isinstance(session, requests.Session):
+        return session.request(method, url, stream=stream, **kwargs)
+
+    # httpx takes a body as `content` and its own timeout object
+    connect, read = kwargs.pop("timeout")
+    if "data" in kwargs:
+        kwargs["content"] = kwargs.pop("data")
+    try:
+        request = session.build_request(method, url, timeout=httpx.Timeout(read, connect=connect), **kwargs)
+        return _as_requests_response(session.send(request, stream=stream), stream)
+    except httpx.HTTPError as e:
+        raise _translate_error(e) from e
+
+
+def open_stream(method, url, **kwargs):
+    return request(method, url, stream=True, **kwargs)
+
+
+# Lines of a streamed response body, as text
+def iter_lines(response):
+    # Event streams are always UTF-8, whatever the headers say
+    response.encoding = "utf-8"
+    return response.iter_lines(decode_unicode=True)
+
+
+# Read the rest of a streamed response body
+def read(response):
+    return response.content
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+# Close every pooled connection
+def close():
+    with _lock:
+        for session in [*_sessions.values(), *_retired]:
+            session.close()
+        _sessions.clear()
+        _retired.clear()
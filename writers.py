@@ -0,0 +1,196 @@
+import csv
+import os
+import time
+
+# pyarrow is optional; it is only needed for Parquet and Arrow output
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# How the output file is opened: replace it, add to it, or add to it while
+# skipping records it already holds
+write_modes = ("overwrite", "append", "merge")
+
+# Output formats, and the file extensions they are picked by
+output_formats = ("csv", "parquet", "arrow")
+_extensions = {".csv": "csv", ".parquet": "parquet", ".arrow": "arrow", ".feather": "arrow"}
+
+
+# Writes trial records to a CSV file as they arrive. Every row is flushed
+# straight away so the file can be tailed during a run; fsync is batched to
+# every `fsync_every` rows or `fsync_interval` seconds, whichever comes first.
+# In merge mode a record whose `key` column (the trial's PMID) is already in
+# the file is skipped. Appending to a file with other columns is refused.
+class CSVWriter:
+    def __init__(
+        self,
+        filename,
+        fieldnames,
+        mode="overwrite",
+        key="PMID",
+        fsync_every=50,
+        fsync_interval=5.0,
+    ):
+        if mode not in write_modes:
+            raise ValueError(f"Unknown write mode {mode!r}, expected one of {write_modes}")
+        self.filename = filename
+        self.mode = mode
+        self.key = key
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.rows = 0
+        self.skipped = 0
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+        exists = os.path.exists(filename) and os.path.getsize(filename) > 0
+        self.seen = set()
+        if mode != "overwrite" and exists:
+            with open(filename, newline="") as file:
+                reader = csv.DictReader(file)
+                if reader.fieldnames != list(fieldnames):
+                    raise ValueError(f"{filename} has other columns than this run writes, it cannot be added to")
+                if mode == "merge":
+                    self.seen = {row.get(key) for row in reader}
+
+        self.file = open(filename, "w" if mode == "overwrite" else "a", newline="")
+        self.writer = csv.DictWriter(self.file, fieldnames=fieldnames)
+        if mode == "overwrite" or not exists:
+            self.writer.writeheader()
+
+    # Write one record; returns False if merge mode skipped it
+    def write(self, record):
+        if self.mode == "merge":
+            if record.get(self.key) in self.seen:
+                self.skipped += 1
+                return False
+            self.seen.add(record.get(self.key))
+        self.writer.writerow(record)
+        self.file.flush()
+        self.rows += 1
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.monotonic() - self.synced_at >= self.fsync_interval:
+            self.sync()
+        return True
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.synced_at = time.monotonic()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.sync()
+        self.file.close()
+        message = f"\nData has been saved to {self.filename} ({self.rows} trials written"
+        if self.skipped:
+            message += f", {self.skipped} already present"
+        print(message + ")")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Base for the columnar writers: rows are buffered and written out as one
+# record batch (a Parquet row group) every `row_group_size` rows. Every
+# column is typed as a string, matching the extracted answers.
+class _ColumnarWriter:
+    format_name = None
+
+    def __init__(self, filename, fieldnames, mode="overwrite", row_group_size=10000):
+        if pa is None:
+            raise RuntimeError(f"pyarrow is required for {self.format_name} output (pip install pyarrow)")
+        if mode != "overwrite":
+            raise ValueError(f"{self.format_name} files can only be written in overwrite mode")
+        self.filename = filename
+        self.fieldnames = list(fieldnames)
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([(name, pa.string()) for name in self.fieldnames])
+        self.buffer = []
+        self.rows = 0
+        self.closed = False
+
+    def write(self, record):
+        self.buffer.append(record)
+        self.rows += 1
+        if len(self.buffer) >= self.row_group_size:
+            self.flush()
+        return True
+
+    # Write the buffered rows as one record batch
+    def flush(self):
+        if not self.buffer:
+            return
+        columns = [
+            pa.array([record.get(name) for record in self.buffer], type=pa.string())
+            for name in self.fieldnames
+        ]
+        self._write_batch(pa.RecordBatch.from_arrays(columns, schema=self.schema))
+        self.buffer = []
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self._close()
+        self.closed = True
+        print(f"\nData has been saved to {self.filename} ({self.rows} trials written)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# Parquet file, zstd compressed, one row group per record batch
+class ParquetWriter(_ColumnarWriter):
+    format_name = "Parquet"
+
+    def __init__(self, filename, fieldnames, mode="overwrite", row_group_size=10000, compression="zstd"):
+        super().__init__(filename, fieldnames, mode, row_group_size)
+        self.writer = pq.ParquetWriter(filename, self.schema, compression=compression)
+
+    def _write_batch(self, batch):
+        self.writer.write_batch(batch)
+
+    def _close(self):
+        self.writer.close()
+
+
+# Arrow IPC file (Feather v2). Left uncompressed so readers can memory-map
+# it with pyarrow.memory_map and load it without copying.
+class ArrowWriter(_ColumnarWriter):
+    format_name = "Arrow"
+
+    def __init__(self, filename, fieldnames, mode="overwrite", row_group_size=10000):
+        super().__init__(filename, fieldnames, mode, row_group_size)
+        self.sink = pa.OSFile(filename, "wb")
+        self.writer = pa.ipc.new_file(self.sink, self.schema)
+
+    def _write_batch(self, batch):
+        self.writer.write_batch(batch)
+
+    def _close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+# Open a writer for `filename`; the format defaults to the one its extension names
+def open_writer(filename, fieldnames, format=None, mode="overwrite"):
+    if format is None:
+        format = _extensions.get(os.path.splitext(filename)[1].lower(), "csv")
+    if format == "csv":
+        return CSVWriter(filename, fieldnames, mode=mode)
+    if format == "parquet":
+        return ParquetWriter(filename, fieldnames, mode=mode)
+    if format == "arrow":
+        return ArrowWriter(filename, fieldnames, mode=mode)
+    raise ValueError(f"Unknown output format {format!r}, expected one of {output_formats}")